@@ -0,0 +1,355 @@
+from game_mechanics import Jewel, Faller, FallerSnapshot, GameState, State, ColumnSet, color_of
+from field_views import FieldView
+import numpy as np
+
+
+_FROZEN = State.FROZEN
+_MATCHED = State.MATCHED
+_EMPTY = 0
+
+_DIRECTIONS = [(0, 1), (1, 0), (1, 1), (1, -1)]
+_key_array = np.zeros((0, 0), dtype=np.uint64)
+
+
+def matched_mask(colors: np.ndarray) -> np.ndarray:
+    '''
+    Returns a boolean mask of every cell that is part of a horizontal,
+    vertical or diagonal line of three or more equal, non-empty colors
+
+    Only the last two axes are treated as (row, column), so a stack of
+    boards can be checked in a single call
+    '''
+    rows, columns = colors.shape[-2:]
+    mask = np.zeros(colors.shape, dtype=bool)
+
+    for rowdelta, coldelta in _DIRECTIONS:
+        if rows < 1 + 2 * rowdelta or columns < 1 + 2 * abs(coldelta):
+            continue
+
+        cells = [colors[..., _window(rows, rowdelta, i), _window(columns, coldelta, i)] for i in range(3)]
+        runs = (cells[0] != _EMPTY) & (cells[0] == cells[1]) & (cells[1] == cells[2])
+
+        for i in range(3):
+            mask[..., _window(rows, rowdelta, i), _window(columns, coldelta, i)] |= runs
+
+    return mask
+
+
+def zobrist_keys(indices: np.ndarray, codes: np.ndarray) -> np.ndarray:
+    '''Returns the Zobrist keys (see game_mechanics.zobrist_key) of the given cell indices and color codes'''
+    key = ((indices.astype(np.uint64) << np.uint64(8)) | codes.astype(np.uint64)) + np.uint64(0x9E3779B97F4A7C15)
+    key = (key ^ (key >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    key = (key ^ (key >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    key = key ^ (key >> np.uint64(31))
+    return np.where(codes != _EMPTY, key, np.uint64(0))
+
+
+def _table_keys(table: list[list[int]], indices: np.ndarray, codes: np.ndarray) -> np.ndarray:
+    '''
+    Returns the Zobrist keys of the given cell indices and color codes from the
+    shared key table, keeping a copy of the table as an array until it grows
+    '''
+    global _key_array
+    if _key_array.shape != (len(table), len(table[0])):
+        _key_array = np.array(table, dtype=np.uint64)
+    return _key_array[codes, indices]
+
+
+def _window(length: int, delta: int, offset: int) -> slice:
+    '''
+    Returns the slice along one axis holding the offset-th cell of every
+    line of three that steps by delta along that axis
+    '''
+    if delta == 0:
+        return slice(0, length)
+    elif delta > 0:
+        return slice(offset, length - 2 + offset)
+    else:
+        return slice(2 - offset, length - offset)
+
+
+class _CellView():
+    def __init__(self, game_state: 'ArrayGameState', row: int, col: int) -> None:
+        self._game_state = game_state
+        self._row = row
+        self._col = col
+
+    def color(self) -> str:
+        '''Returns the color of the Jewel in this cell'''
+        return color_of(self._game_state._colors[self._row, self._col])
+
+    def code(self) -> int:
+        '''Returns the color code of the Jewel in this cell'''
+        return int(self._game_state._colors[self._row, self._col])
+
+    def state(self) -> State:
+        '''Returns the state of the Jewel in this cell'''
+        return State(self._game_state._states[self._row, self._col])
+
+    def update_state(self, state: State) -> None:
+        '''Updates the state of the Jewel in this cell'''
+        self._game_state._states[self._row, self._col] = state
+
+
+class ArrayGameState(GameState):
+    '''
+    A GameState whose field is stored as two uint8 planes (color codes and
+    state codes) instead of a nested list of Jewels, so that the whole-board
+    operations run as array operations
+
+    field() hands out a view with the same indexing as the nested list,
+    so Faller and Columns work with either backend
+    '''
+    _placed_faller = None
+    _faller_cells = {}
+
+    def __init__(self, rows: int, columns: int, field: list[list[Jewel]] = None) -> None:
+        super().__init__(rows, columns, None)
+        self._colors = np.zeros((rows + 2, columns), dtype=np.uint8)
+        self._states = np.zeros((rows + 2, columns), dtype=np.uint8)
+
+        if field is not None:
+            for r, row in enumerate(field):
+                for c, jewel in enumerate(row):
+                    self._put(r, c, jewel)
+
+        self._field = FieldView(self)
+        self._hash = self._full_hash()
+        self._matched_count = self._count_matched()
+        self._build_index()
+
+    @property
+    def _faller(self) -> Faller or None:
+        return self.__dict__.get("_faller")
+
+    @_faller.setter
+    def _faller(self, faller: Faller or None) -> None:
+        '''
+        Stores the Faller; when the Faller is dropped (it froze), the final
+        states of its Jewels are written into the state plane first
+        '''
+        if faller is None:
+            self._sync_faller()
+            self._placed_faller = None
+            self._faller_cells = {}
+        self.__dict__["_faller"] = faller
+
+    def field(self) -> FieldView:
+        '''Returns a view of the field that is indexed like list[list[Jewel]]'''
+        self._sync_faller()
+        return self._field
+
+    def planes(self) -> tuple[np.ndarray, np.ndarray]:
+        '''Returns the color code and state code planes of the field'''
+        self._sync_faller()
+        return self._colors, self._states
+
+    def place_faller(self, faller: Faller) -> None:
+        '''
+        Updates the game state with a Faller and places the Faller in the field
+
+        If there is no space in the field for the Faller to be created,
+        the _game_over attribute is set to True
+        '''
+        super().place_faller(faller)
+        if not self._game_over:
+            self._placed_faller = faller
+            self._faller_cells = {id(jewel): (i, faller.col()) for i, jewel in enumerate(faller.components())}
+            self._sync_faller()
+
+    def normal_gravity(self) -> list[list[tuple[int, int]]]:
+        '''
+        Drops every Jewel to the bottom of the field, leaving no spaces under them;
+        returns, for every column, the (from_row, to_row) pairs of the Jewels that moved
+
+        The hash is updated from the keys of the Jewels that moved only
+        '''
+        self._sync_faller()
+        occupied = self._colors != _EMPTY
+        occupied_below = np.cumsum(occupied[::-1], axis=0)[::-1]
+        target_rows = self._rows + 2 - occupied_below[occupied]
+        rows, cols = np.nonzero(occupied)
+        moved = rows != target_rows
+        moved_from = np.zeros_like(occupied)
+        moved_from[rows[moved], cols[moved]] = True
+        moved_to = np.zeros_like(occupied)
+        moved_to[target_rows[moved], cols[moved]] = True
+        self._hash ^= self._xor_keys(moved_from)
+
+        colors = np.zeros_like(self._colors)
+        states = np.zeros_like(self._states)
+        colors[target_rows, cols] = self._colors[rows, cols]
+        states[target_rows, cols] = self._states[rows, cols]
+        self._colors = colors
+        self._states = states
+        self._hash ^= self._xor_keys(moved_to)
+        self._index_top_rows()
+
+        for key, (r, c) in self._faller_cells.items():
+            self._faller_cells[key] = (self._rows + 2 - occupied_below[r, c], c)
+
+        return self._column_moves(rows, target_rows, cols)
+
+    def tick_gravity(self) -> list[list[tuple[int, int]]]:
+        '''
+        Drops every Jewel/Faller in the field once, given that there is a space under it;
+        returns, for every column, the (from_row, to_row) pairs of the Jewels that moved
+
+        The hash is updated from the keys of the Jewels that moved only
+        '''
+        self._sync_faller()
+        empty_at_or_below = np.cumsum((self._colors == _EMPTY)[::-1], axis=0)[::-1] > 0
+        moving = np.zeros_like(empty_at_or_below)
+        moving[:-1] = (self._colors[:-1] != _EMPTY) & empty_at_or_below[1:]
+        moved_to = np.zeros_like(moving)
+        moved_to[1:] = moving[:-1]
+        self._hash ^= self._xor_keys(moving)
+
+        colors = np.where(moving, _EMPTY, self._colors)
+        states = np.where(moving, _FROZEN, self._states)
+        colors[1:][moving[:-1]] = self._colors[:-1][moving[:-1]]
+        states[1:][moving[:-1]] = self._states[:-1][moving[:-1]]
+        self._colors = colors.astype(np.uint8)
+        self._states = states.astype(np.uint8)
+        self._hash ^= self._xor_keys(moved_to)
+        self._index_top_rows()
+
+        for key, (r, c) in self._faller_cells.items():
+            if moving[r, c]:
+                self._faller_cells[key] = (r + 1, c)
+
+        if self._faller != None and self._faller.state() == State.FALLING:
+            self._faller._row += 1
+
+        rows, cols = np.nonzero(moving)
+        return self._column_moves(rows, rows + 1, cols)
+
+    def remove_matches(self) -> None:
+        '''Removes matched Jewels from the field'''
+        self._sync_faller()
+        matched = self._states == _MATCHED
+        self._hash ^= self._xor_keys(matched)
+        self._colors[matched] = _EMPTY
+        self._states[matched] = _FROZEN
+        self._matched_count = 0
+        self._heights = np.count_nonzero(self._colors, axis=0).tolist()
+        self._index_top_rows()
+        self._faller_cells = {key: cell for key, cell in self._faller_cells.items() if not matched[cell]}
+
+    def match(self, incremental: bool = False) -> set[tuple[int, int]]:
+        '''
+        Marks every Jewel in a line of three or more matching Jewels as MATCHED
+        and returns the set of (row, column) coordinates that were matched
+
+        The whole board is checked in one array pass, so incremental is accepted
+        for compatibility with GameState but not needed
+        '''
+        self._sync_faller()
+        mask = matched_mask(self._colors)
+        self._matched_count += int((mask & (self._states != _MATCHED)).sum())
+        self._states[mask] = _MATCHED
+        self._dirty = set()
+        self._all_dirty = False
+        return {(int(r), int(c)) for r, c in zip(*np.nonzero(mask))}
+
+    def _column_moves(self, from_rows: np.ndarray, to_rows: np.ndarray, cols: np.ndarray) -> list[list[tuple[int, int]]]:
+        '''Groups the cells that moved by column, in the order the list-backed GameState reports them'''
+        moves = [[] for _ in range(self._columns)]
+        order = np.lexsort((-from_rows, cols))
+        for i in order[from_rows[order] != to_rows[order]]:
+            moves[cols[i]].append((int(from_rows[i]), int(to_rows[i])))
+        return moves
+
+    def _build_index(self) -> None:
+        '''Rebuilds the column heights, the free columns and the Jewels in the hidden rows in one array pass'''
+        self._heights = np.count_nonzero(self._colors, axis=0).tolist()
+        self._free_columns = ColumnSet(self._columns, np.flatnonzero(self._colors[2] == _EMPTY).tolist())
+        self._hidden = {(int(r), int(c)) for r, c in zip(*np.nonzero(self._colors[:2] != _EMPTY))}
+
+    def _index_top_rows(self) -> None:
+        '''
+        Brings the free columns and the Jewels in the hidden rows up to date after
+        the planes were rewritten as a whole, touching only the columns whose top
+        visible cell changed
+        '''
+        free = self._colors[2] == _EMPTY
+        was_free = np.frombuffer(self._free_columns.mask(), dtype=np.uint8).astype(bool)
+        for c in np.flatnonzero(free != was_free).tolist():
+            if free[c]:
+                self._free_columns.add(c)
+            else:
+                self._free_columns.discard(c)
+        self._hidden = {(int(r), int(c)) for r, c in zip(*np.nonzero(self._colors[:2] != _EMPTY))}
+
+    def _count_matched(self) -> int:
+        '''Returns the number of matched Jewels in the field, counted in one array pass'''
+        return int((self._states == _MATCHED).sum())
+
+    def _full_hash(self) -> int:
+        '''Returns the Zobrist hash of the colors in the field, computed in one array pass'''
+        return self._xor_keys(self._colors != _EMPTY)
+
+    def _xor_keys(self, mask: np.ndarray) -> int:
+        '''Returns the XOR of the Zobrist keys of the colors in the cells selected by the mask'''
+        indices = np.flatnonzero(mask)
+        codes = self._colors.ravel()[indices]
+        if self._keys is not None:
+            keys = _table_keys(self._keys, indices, codes)
+        else:
+            keys = zobrist_keys(indices, codes)
+        return int(np.bitwise_xor.reduce(keys)) if len(keys) else 0
+
+    def _cells(self) -> bytes:
+        '''Returns the color codes of every cell of the field followed by their states'''
+        self._sync_faller()
+        return self._colors.tobytes() + self._states.tobytes()
+
+    def _load_cells(self, cells: bytes) -> None:
+        '''Replaces both planes with the color codes and states as returned by _cells'''
+        planes = np.frombuffer(cells, dtype=np.uint8).reshape(2, self._rows + 2, self._columns)
+        self._colors = planes[0].copy()
+        self._states = planes[1].copy()
+
+    def _faller_cell_rows(self) -> list[int]:
+        '''Returns the row of the field holding each of the Faller's Jewels, or -1 for one that is not in the field'''
+        return [self._faller_cells.get(id(jewel), (-1, None))[0] for jewel in self._faller.components()]
+
+    def _faller_components(self, saved: FallerSnapshot) -> list[Jewel]:
+        '''Returns new Jewels for a restored Faller, since the planes hold no Jewel objects'''
+        return [Jewel(color_of(code)) for code in saved.codes]
+
+    def _faller_restored(self, saved: FallerSnapshot) -> None:
+        '''Starts tracking the cells of the restored Faller's Jewels again'''
+        if any(r >= 0 for r in saved.cell_rows):
+            self._placed_faller = self._faller
+            self._faller_cells = {id(jewel): (r, saved.col)
+                                  for jewel, r in zip(self._faller.components(), saved.cell_rows) if r >= 0}
+
+    def _cell(self, row: int, col: int) -> _CellView:
+        '''Returns a view of a cell of the field'''
+        return _CellView(self, row, col)
+
+    def _put(self, row: int, col: int, jewel: Jewel) -> None:
+        '''Writes the color and state of the given Jewel into the cell'''
+        self._colors[row, col] = jewel.code()
+        self._states[row, col] = jewel.state()
+
+        if self._placed_faller is not None:
+            self._faller_cells = {key: cell for key, cell in self._faller_cells.items() if cell != (row, col)}
+            if any(jewel is component for component in self._placed_faller.components()):
+                self._faller_cells[id(jewel)] = (row, col)
+
+    def _sync_faller(self) -> None:
+        '''
+        Copies the states of the placed Faller's Jewels into the state plane,
+        since Faller updates the states on its Jewel objects directly
+
+        The cells of the Faller's Jewels are tracked as they are written and
+        moved, because the Faller's own row is not advanced once it landed
+        '''
+        faller = self._placed_faller
+        if faller is not None:
+            for jewel in faller.components():
+                cell = self._faller_cells.get(id(jewel))
+                if cell is not None:
+                    self._states[cell] = jewel.state()
@@ -0,0 +1,239 @@
+from game_mechanics import CascadeCache, GameState, Snapshot, create_empty_field
+from simulation import Simulation, JEWEL_COLORS
+from concurrent.futures import FIRST_EXCEPTION, ProcessPoolExecutor, wait
+from typing import Callable, NamedTuple
+import random
+import time
+
+
+_DEPTH = 1
+_TIME_BUDGET = 0.5
+_SAMPLES = 4
+_cascade_cache = CascadeCache()
+
+
+class Outcome(NamedTuple):
+    jewels_cleared: int
+    chain: int
+    game_over: bool
+
+
+class Placement(NamedTuple):
+    column: int
+    rotations: int
+    actions: list[str]
+    score: float
+
+
+def default_heuristic(game_state: GameState, outcome: Outcome) -> float:
+    '''
+    Scores a settled board after a placement: clearing Jewels, chains and
+    neighboring Jewels of the same color (future matches) are rewarded, tall
+    and uneven stacks are penalized and losing is worst
+    '''
+    if outcome.game_over:
+        return -1e9
+
+    heights = _column_heights(game_state)
+    bumpiness = sum(abs(a - b) for a, b in zip(heights, heights[1:]))
+    return (10 * outcome.jewels_cleared + 25 * (outcome.chain - 1 if outcome.chain > 1 else 0)
+            + 2 * _same_color_neighbors(game_state)
+            - 3 * max(heights) - sum(heights) / len(heights) - bumpiness)
+
+
+def _column_heights(game_state: GameState) -> list[int]:
+    '''Returns the number of Jewels in each column of the field'''
+    return [game_state.column_height(c) for c in range(game_state.columns())]
+
+
+def _same_color_neighbors(game_state: GameState) -> int:
+    '''Returns the number of pairs of neighboring Jewels (in any direction) that have the same color'''
+    field = game_state.field()
+    rows, columns = len(field), game_state.columns()
+    codes = [[jewel.code() for jewel in row] for row in field]
+    pairs = 0
+
+    for r in range(rows):
+        for c in range(columns):
+            code = codes[r][c]
+            if code == 0:
+                continue
+            for dr, dc in ((0, 1), (1, 0), (1, 1), (1, -1)):
+                if 0 <= r + dr < rows and 0 <= c + dc < columns and codes[r + dr][c + dc] == code:
+                    pairs += 1
+    return pairs
+
+
+def candidate_actions(game_state: GameState) -> list[tuple[int, int, list[str]]]:
+    '''
+    Returns every (column, rotations, actions) that could place the current
+    Faller: each of its three rotations in each column of the field; columns
+    that turn out to be blocked are dropped when the actions are simulated
+    '''
+    faller = game_state.faller()
+    seen = set()
+    candidates = []
+
+    for rotations in range(3):
+        codes = [jewel.code() for jewel in faller.components()]
+        codes = codes[-rotations:] + codes[:-rotations] if rotations else codes
+        if tuple(codes) in seen:
+            continue
+        seen.add(tuple(codes))
+
+        for column in range(game_state.columns()):
+            moves = column - faller.col()
+            actions = ["rotate"] * rotations + (["right"] * moves if moves > 0 else ["left"] * -moves)
+            candidates.append((column, rotations, actions))
+
+    return candidates
+
+
+def play_out(game_state: GameState, actions: list[str], colors: list[str],
+             cache: CascadeCache = None) -> Outcome or None:
+    '''
+    Applies the actions to the Faller in the game state, then drops and freezes
+    it and resolves the whole cascade (through the cache, if one is given);
+    returns None if the actions could not all be applied (the Faller was blocked)
+    '''
+    simulation = Simulation(game_state=game_state, colors=colors, instant_cascades=True, cascade_cache=cache)
+    faller = game_state.faller()
+    target = faller.col() + actions.count("right") - actions.count("left")
+
+    for action in actions:
+        simulation.apply_action(action)
+    if faller.col() != target:
+        return None
+
+    while game_state.faller() != None:
+        simulation.tick()
+
+    stats = simulation.stats()
+    return Outcome(stats.jewels_cleared, stats.max_chain, simulation.check_game_over())
+
+
+def evaluate(snapshot: Snapshot, actions: list[str], depth: int, samples: int, seed: int,
+             heuristic: Callable[[GameState, Outcome], float], colors: list[str]) -> float or None:
+    '''
+    Returns the score of applying the actions to the Faller in the snapshot:
+    the heuristic score of the settled board, plus (for depth > 1) the mean
+    best score over sampled next Fallers; None if the placement is not reachable
+    '''
+    game_state = GameState(snapshot.rows, snapshot.columns, create_empty_field(snapshot.rows, snapshot.columns))
+    game_state.restore(snapshot)
+
+    outcome = play_out(game_state, actions, colors, _cascade_cache)
+    if outcome is None:
+        return None
+
+    score = heuristic(game_state, outcome)
+    if depth <= 1 or outcome.game_over:
+        return score
+
+    settled = game_state.snapshot()
+    rng = random.Random(seed)
+    future = 0.0
+    for _ in range(samples):
+        game_state.restore(settled)
+        spawn = Simulation(rng.getrandbits(32), game_state=game_state, colors=colors)
+        spawn.create_faller()
+        if game_state.game_over() or game_state.faller() == None:
+            future += heuristic(game_state, Outcome(0, 0, True))
+            continue
+
+        next_snapshot = game_state.snapshot()
+        scores = [evaluate(next_snapshot, next_actions, depth - 1, samples, rng.getrandbits(32), heuristic, colors)
+                  for _, _, next_actions in candidate_actions(game_state)]
+        future += max((s for s in scores if s is not None), default=heuristic(game_state, Outcome(0, 0, True)))
+
+    return score + future / samples
+
+
+def _evaluate_task(task: tuple) -> float or None:
+    '''Runs evaluate in a worker process'''
+    return evaluate(*task)
+
+
+class AutoPlayer():
+    '''
+    Chooses where to place each new Faller by simulating every reachable column
+    and rotation on a scratch board and scoring the result with a pluggable
+    heuristic
+
+    With depth > 1, each placement is also scored by the best follow-up placement
+    over a few sampled next Fallers; the search deepens one level at a time and
+    returns the best placement of the deepest level finished within the time
+    budget. With workers > 0, candidates are evaluated in a process pool (the
+    heuristic must then be a module-level function)
+    '''
+    def __init__(self, heuristic: Callable[[GameState, Outcome], float] = default_heuristic,
+                 depth: int = _DEPTH, time_budget: float = _TIME_BUDGET, samples: int = _SAMPLES,
+                 workers: int = 0, colors: list[str] = JEWEL_COLORS, seed: int = None) -> None:
+        self._heuristic = heuristic
+        self._depth = depth
+        self._time_budget = time_budget
+        self._samples = samples
+        self._colors = colors
+        self._random = random.Random(seed)
+        self._executor = ProcessPoolExecutor(max_workers=workers) if workers > 0 else None
+
+    def close(self) -> None:
+        '''Shuts down the worker processes, if there are any'''
+        if self._executor is not None:
+            self._executor.shutdown(cancel_futures=True)
+            self._executor = None
+
+    def choose(self, game_state: GameState) -> Placement or None:
+        '''Returns the best placement for the current Faller, or None if there is no Faller'''
+        if game_state.faller() == None:
+            return None
+
+        deadline = time.perf_counter() + self._time_budget
+        snapshot = game_state.snapshot()
+        candidates = candidate_actions(game_state)
+        best = None
+
+        for depth in range(1, self._depth + 1):
+            seeds = [self._random.getrandbits(32) for _ in candidates]
+            tasks = [(snapshot, actions, depth, self._samples, seed, self._heuristic, self._colors)
+                     for (_, _, actions), seed in zip(candidates, seeds)]
+
+            scores = self._evaluate_all(tasks, deadline)
+            if scores is None:
+                break
+
+            placements = [Placement(column, rotations, actions, score)
+                          for (column, rotations, actions), score in zip(candidates, scores) if score is not None]
+            if placements:
+                best = max(placements, key=lambda placement: placement.score)
+
+            if time.perf_counter() >= deadline:
+                break
+
+        if best is None:
+            return Placement(game_state.faller().col(), 0, [], 0.0)
+        return best
+
+    def _evaluate_all(self, tasks: list[tuple], deadline: float) -> list[float or None] or None:
+        '''
+        Evaluates every task, returning their scores, or None if the deadline passed
+        first (the first search level is always finished, so there is always a move)
+        '''
+        first_level = tasks[0][2] == 1 if tasks else True
+
+        if self._executor is None:
+            scores = []
+            for task in tasks:
+                if not first_level and time.perf_counter() >= deadline:
+                    return None
+                scores.append(evaluate(*task))
+            return scores
+
+        futures = [self._executor.submit(_evaluate_task, task) for task in tasks]
+        timeout = None if first_level else max(0.0, deadline - time.perf_counter())
+        done, not_done = wait(futures, timeout=timeout, return_when=FIRST_EXCEPTION)
+        if not_done:
+            for future in not_done:
+                future.cancel()
+            return None
+        return [future.result() for future in futures]
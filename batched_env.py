@@ -0,0 +1,314 @@
+from game_mechanics import State, color_code
+from array_board import matched_mask
+from simulation import COLUMN_COUNT, JEWEL_COLORS, ROW_COUNT
+import numpy as np
+
+
+_ACTIONS = ["none", "left", "right", "rotate", "drop"]
+_NONE, _LEFT, _RIGHT, _ROTATE, _DROP = range(len(_ACTIONS))
+_FROZEN = State.FROZEN
+_FALLING = State.FALLING
+_LANDED = State.LANDED
+_MATCHED = State.MATCHED
+_EMPTY = 0
+_FALLER_ROWS = np.array([-2, -1, 0])
+
+
+class BatchedEnv():
+    '''
+    Steps a batch of Columns games in lockstep for reinforcement learning: the
+    boards are stacked into two (count, rows + 2, columns) uint8 arrays of color
+    codes and states (as in ArrayGameState), and every rule of the game runs as
+    array operations over all the boards that it applies to at once
+
+    Each step applies one action per board (an index into actions(): none,
+    left, right, rotate, or drop, which moves the Faller straight down onto
+    the stack), ticks every board as Simulation.tick does, ends the games that
+    are over and creates the next Fallers, so an observation always shows the
+    Faller the next action applies to. Finished games are reset in place;
+    their scores can be read with finished_episodes()
+    '''
+    def __init__(self, count: int, rows: int = ROW_COUNT, columns: int = COLUMN_COUNT,
+                 colors: list[str] = JEWEL_COLORS, seed: int = None, max_ticks: int = None) -> None:
+        self._count = count
+        self._rows = rows
+        self._height = rows + 2
+        self._columns = columns
+        self._codes = np.array([color_code(color) for color in colors], dtype=np.uint8)
+        self._random = np.random.default_rng(seed)
+        self._max_ticks = max_ticks
+
+        self._colors = np.zeros((count, self._height, columns), dtype=np.uint8)
+        self._states = np.zeros((count, self._height, columns), dtype=np.uint8)
+        self._faller_row = np.zeros(count, dtype=np.int64)
+        self._faller_col = np.zeros(count, dtype=np.int64)
+        self._faller_state = np.zeros(count, dtype=np.uint8)
+        self._ticks = np.zeros(count, dtype=np.int64)
+        self._scores = np.zeros(count, dtype=np.int64)
+        self._finished = []
+
+    def actions(self) -> list[str]:
+        '''Returns the names of the actions, indexed by the action codes that step() takes'''
+        return list(_ACTIONS)
+
+    def observations(self) -> np.ndarray:
+        '''
+        Returns a copy of every board as a (count, 2, rows + 2, columns) uint8
+        array: the color codes and then the states of the cells, hidden rows included
+        '''
+        return np.stack((self._colors, self._states), axis=1)
+
+    def finished_episodes(self) -> list[tuple[int, int]]:
+        '''Returns the (jewels cleared, ticks) of every game that finished since the last call'''
+        finished = self._finished
+        self._finished = []
+        return finished
+
+    def reset(self) -> np.ndarray:
+        '''Starts a new game on every board and returns the observations'''
+        self._reset(np.arange(self._count))
+        return self.observations()
+
+    def step(self, actions: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        '''
+        Applies one action to every board and advances every board by one tick;
+        returns the observations, the number of Jewels each board cleared (as
+        float32 rewards) and whether each board's game ended (it was reset, so
+        its observation is already the start of a new game)
+        '''
+        actions = np.asarray(actions)
+        if actions.shape != (self._count,):
+            raise ValueError(f"expected {self._count} actions, got an array of shape {actions.shape}")
+
+        self._apply_actions(actions)
+        rewards = self._tick()
+        self._ticks += 1
+        self._scores += rewards
+
+        dones = self._game_over()
+        dones |= self._spawn(np.flatnonzero(~dones))
+        if self._max_ticks is not None:
+            dones |= self._ticks >= self._max_ticks
+
+        finished = np.flatnonzero(dones)
+        self._finished.extend(zip(self._scores[finished].tolist(), self._ticks[finished].tolist()))
+        self._reset(finished)
+
+        return self.observations(), rewards.astype(np.float32), dones
+
+    def _reset(self, boards: np.ndarray) -> None:
+        '''Empties the given boards and creates their first Fallers'''
+        self._colors[boards] = _EMPTY
+        self._states[boards] = _FROZEN
+        self._faller_state[boards] = _FROZEN
+        self._ticks[boards] = 0
+        self._scores[boards] = 0
+        self._spawn(boards)
+
+    def _spawn(self, boards: np.ndarray) -> np.ndarray:
+        '''
+        Creates a Faller with random colors in a random free column of each of
+        the given boards that has no Faller and no matched Jewels; returns a mask
+        (over every board) of the boards that had no free column, whose games are over
+        '''
+        boards = boards[(self._faller_state[boards] == _FROZEN)
+                        & ~(self._states[boards] == _MATCHED).any(axis=(1, 2))]
+        blocked = np.zeros(self._count, dtype=bool)
+        if len(boards) == 0:
+            return blocked
+
+        free = self._colors[boards, 2] == _EMPTY
+        has_free = free.any(axis=1)
+        blocked[boards[~has_free]] = True
+        boards, free = boards[has_free], free[has_free]
+
+        columns = np.where(free, self._random.random(free.shape), -1.0).argmax(axis=1)
+        codes = self._codes[self._random.integers(0, len(self._codes), (len(boards), 3))]
+        self._faller_row[boards] = 2
+        self._faller_col[boards] = columns
+        b, rows, cols = self._faller_cells(boards)
+        self._colors[b, rows, cols] = codes
+        self._set_faller_state(boards, _FALLING)
+        self._check_landed(boards)
+        return blocked
+
+    def _apply_actions(self, actions: np.ndarray) -> None:
+        '''Applies every board's action to its Faller, as Simulation.apply_action does'''
+        has_faller = self._faller_state != _FROZEN
+
+        for action, delta in ((_LEFT, -1), (_RIGHT, 1)):
+            boards = np.flatnonzero(has_faller & (actions == action))
+            target = self._faller_col[boards] + delta
+            inside = (target >= 0) & (target < self._columns)
+            boards, target = boards[inside], target[inside]
+            empty = self._colors[boards, self._faller_row[boards], target] == _EMPTY
+            self._move_faller(boards[empty], 0, delta)
+            self._check_landed(boards)
+            self._check_unlanded(boards)
+
+        boards = np.flatnonzero(has_faller & (actions == _ROTATE))
+        cells = self._faller_cells(boards)
+        self._colors[cells] = np.roll(self._colors[cells], 1, axis=1)
+
+        boards = np.flatnonzero(has_faller & (actions == _DROP) & (self._faller_state == _FALLING))
+        column = self._colors[boards, :, self._faller_col[boards]]
+        below = np.arange(self._height) > self._faller_row[boards, None]
+        stack = (column != _EMPTY) & below
+        top = np.where(stack.any(axis=1), stack.argmax(axis=1), self._height)
+        self._move_faller(boards, top - 1 - self._faller_row[boards], 0)
+        self._check_landed(boards)
+
+    def _tick(self) -> np.ndarray:
+        '''
+        Advances every board by one tick, as Simulation.tick does: boards with a
+        Faller drop it (and land or freeze it, matching once it froze), boards
+        without one remove their matches, drop their Jewels and match again;
+        returns the number of Jewels each board matched
+        '''
+        rewards = np.zeros(self._count, dtype=np.int64)
+        has_faller = self._faller_state != _FROZEN
+
+        boards = np.flatnonzero(has_faller)
+        was_falling = self._faller_state[boards] == _FALLING
+        moving = self._tick_gravity(boards)
+        self._faller_row[boards] += moving[np.arange(len(boards)), self._faller_row[boards], self._faller_col[boards]]
+        self._check_landed(boards[was_falling])
+
+        landed = boards[~was_falling]
+        self._check_unlanded(landed)
+        frozen = landed[self._faller_state[landed] == _LANDED]
+        self._set_faller_state(frozen, _FROZEN)
+        rewards[frozen] = self._match(frozen)
+
+        boards = np.flatnonzero(~has_faller)
+        self._remove_matches(boards)
+        self._normal_gravity(boards)
+        rewards[boards] = self._match(boards)
+        return rewards
+
+    def _game_over(self) -> np.ndarray:
+        '''
+        Returns a mask of the boards whose game is over: they have no Faller, no
+        matched Jewels and a frozen Jewel or space in a column holding a Jewel in
+        the hidden rows, as GameState.check_game_over decides
+        '''
+        hidden = (self._colors[:, :2] != _EMPTY).any(axis=1)
+        frozen = (self._states[:, :2] == _FROZEN).any(axis=1)
+        return ((hidden & frozen).any(axis=1) & (self._faller_state == _FROZEN)
+                & ~(self._states == _MATCHED).any(axis=(1, 2)))
+
+    def _faller_cells(self, boards: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        '''Returns the (board, row, column) indices of the three cells of each given board's Faller, top first'''
+        return boards[:, None], self._faller_row[boards, None] + _FALLER_ROWS, self._faller_col[boards, None]
+
+    def _set_faller_state(self, boards: np.ndarray, state: State) -> None:
+        '''Updates the state of the given boards' Fallers and their Jewels (FROZEN drops the Faller)'''
+        self._faller_state[boards] = state
+        self._states[self._faller_cells(boards)] = state
+
+    def _check_landed(self, boards: np.ndarray) -> None:
+        '''Lands the falling Fallers of the given boards that are on the bottom row or on a Jewel'''
+        boards = boards[self._faller_state[boards] == _FALLING]
+        below = self._faller_row[boards] + 1
+        on_bottom = below == self._height
+        on_jewel = self._colors[boards, np.minimum(below, self._height - 1), self._faller_col[boards]] != _EMPTY
+        self._set_faller_state(boards[on_bottom | on_jewel], _LANDED)
+
+    def _check_unlanded(self, boards: np.ndarray) -> None:
+        '''Makes the landed Fallers of the given boards that have a space under them fall again'''
+        boards = boards[(self._faller_state[boards] == _LANDED) & (self._faller_row[boards] < self._rows - 1)]
+        space = self._colors[boards, self._faller_row[boards] + 1, self._faller_col[boards]] == _EMPTY
+        self._set_faller_state(boards[space], _FALLING)
+
+    def _move_faller(self, boards: np.ndarray, rowdelta: np.ndarray or int, coldelta: int) -> None:
+        '''Moves the Faller of each given board by the given number of rows and columns'''
+        cells = self._faller_cells(boards)
+        colors = self._colors[cells]
+        states = self._states[cells]
+        self._colors[cells] = _EMPTY
+        self._states[cells] = _FROZEN
+
+        self._faller_row[boards] += rowdelta
+        self._faller_col[boards] += coldelta
+        cells = self._faller_cells(boards)
+        self._colors[cells] = colors
+        self._states[cells] = states
+
+    def _tick_gravity(self, boards: np.ndarray) -> np.ndarray:
+        '''
+        Drops every Jewel of the given boards that has a space under it by one
+        row; returns the mask of the cells (of those boards) whose Jewels moved
+        '''
+        colors = self._colors[boards]
+        states = self._states[boards]
+        empty_at_or_below = np.cumsum((colors == _EMPTY)[:, ::-1], axis=1)[:, ::-1] > 0
+        moving = np.zeros_like(empty_at_or_below)
+        moving[:, :-1] = (colors[:, :-1] != _EMPTY) & empty_at_or_below[:, 1:]
+
+        dropped_colors = np.where(moving, _EMPTY, colors).astype(np.uint8)
+        dropped_states = np.where(moving, _FROZEN, states).astype(np.uint8)
+        dropped_colors[:, 1:][moving[:, :-1]] = colors[:, :-1][moving[:, :-1]]
+        dropped_states[:, 1:][moving[:, :-1]] = states[:, :-1][moving[:, :-1]]
+        self._colors[boards] = dropped_colors
+        self._states[boards] = dropped_states
+        return moving
+
+    def _normal_gravity(self, boards: np.ndarray) -> None:
+        '''Drops every Jewel of the given boards to the bottom, leaving no spaces under them'''
+        colors = self._colors[boards]
+        states = self._states[boards]
+        occupied = colors != _EMPTY
+        occupied_below = np.cumsum(occupied[:, ::-1], axis=1)[:, ::-1]
+        b, rows, cols = np.nonzero(occupied)
+        target_rows = self._height - occupied_below[b, rows, cols]
+
+        dropped_colors = np.zeros_like(colors)
+        dropped_states = np.zeros_like(states)
+        dropped_colors[b, target_rows, cols] = colors[b, rows, cols]
+        dropped_states[b, target_rows, cols] = states[b, rows, cols]
+        self._colors[boards] = dropped_colors
+        self._states[boards] = dropped_states
+
+    def _remove_matches(self, boards: np.ndarray) -> None:
+        '''Removes the matched Jewels of the given boards'''
+        colors = self._colors[boards]
+        states = self._states[boards]
+        matched = states == _MATCHED
+        colors[matched] = _EMPTY
+        states[matched] = _FROZEN
+        self._colors[boards] = colors
+        self._states[boards] = states
+
+    def _match(self, boards: np.ndarray) -> np.ndarray:
+        '''Marks the Jewels in lines of three or more on the given boards as MATCHED; returns how many each board has'''
+        mask = matched_mask(self._colors[boards])
+        states = self._states[boards]
+        states[mask] = _MATCHED
+        self._states[boards] = states
+        return mask.sum(axis=(1, 2))
+
+
+if __name__ == "__main__":
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser(description="Step a batch of Columns games with random actions and report the throughput")
+    parser.add_argument("--count", type=int, default=1024, help="number of boards")
+    parser.add_argument("--steps", type=int, default=1000)
+    parser.add_argument("--rows", type=int, default=ROW_COUNT)
+    parser.add_argument("--columns", type=int, default=COLUMN_COUNT)
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    env = BatchedEnv(args.count, args.rows, args.columns, seed=args.seed)
+    env.reset()
+    rng = np.random.default_rng(args.seed)
+    start = time.perf_counter()
+    for _ in range(args.steps):
+        env.step(rng.integers(0, len(_ACTIONS), args.count))
+    elapsed = time.perf_counter() - start
+
+    episodes = env.finished_episodes()
+    print(f"{args.count * args.steps / elapsed:,.0f} board-steps/s over {args.count} boards")
+    if episodes:
+        print(f"{len(episodes)} games finished, {sum(score for score, _ in episodes) / len(episodes):.1f} jewels cleared on average")
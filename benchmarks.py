@@ -0,0 +1,188 @@
+from game_mechanics import Jewel, GameState, create_empty_field
+from simulation import Simulation
+from sparse_board import SparseGameState
+from typing import Callable
+import argparse
+import json
+import platform
+import random
+import statistics
+import sys
+import time
+
+try:
+    from array_board import ArrayGameState
+except ImportError:
+    ArrayGameState = None
+
+
+_JEWEL_COLORS = ["R", "O", "Y", "G", "B", "P", "Z"]
+_SIZES = [(13, 6), (50, 50), (200, 200), (1000, 1000)]
+_DENSITIES = [0.1, 0.5, 0.9]
+_REPEAT = 5
+_THRESHOLD = 0.10
+
+
+def random_field(rows: int, columns: int, density: float, seed: int) -> list[list[Jewel]]:
+    '''Returns a field in which each cell holds a Jewel of a random color with the given probability'''
+    rng = random.Random(seed)
+    return [[Jewel(rng.choice(_JEWEL_COLORS)) if rng.random() < density else Jewel(" ") for _ in range(columns)]
+            for _ in range(rows + 2)]
+
+
+def make_game_state(backend: str, rows: int, columns: int, field: list[list[Jewel]]) -> GameState:
+    '''Returns a GameState of the given backend ("list", "array" or "sparse") holding the given field'''
+    if backend == "array":
+        return ArrayGameState(rows, columns, field)
+    elif backend == "sparse":
+        return SparseGameState(rows, columns, field)
+    return GameState(rows, columns, field)
+
+
+def _playable(game_state: GameState) -> GameState:
+    '''Settles the field and clears its top rows so that a Faller can be created and dropped'''
+    game_state.normal_gravity()
+    for r in range(min(5, game_state.rows() + 2)):
+        for c in range(game_state.columns()):
+            game_state._set_cell(r, c, Jewel(" "))
+    return game_state
+
+
+def _cases(backend: str) -> dict[str, tuple[Callable, Callable]]:
+    '''
+    Returns the benchmarks as name -> (setup, run): setup(rows, columns, density, seed)
+    builds what run times, so that only run is measured
+    '''
+    def board(rows, columns, density, seed):
+        return make_game_state(backend, rows, columns, random_field(rows, columns, density, seed))
+
+    def matched_board(rows, columns, density, seed):
+        game_state = board(rows, columns, density, seed)
+        game_state.match()
+        return game_state
+
+    def playable_simulation(rows, columns, density, seed):
+        return Simulation(seed, game_state=_playable(board(rows, columns, density, seed)))
+
+    return {
+        "match": (board, lambda game_state: game_state.match()),
+        "remove_matches": (matched_board, lambda game_state: game_state.remove_matches()),
+        "normal_gravity": (board, lambda game_state: game_state.normal_gravity()),
+        "tick_gravity": (board, lambda game_state: game_state.tick_gravity()),
+        "check_match": (matched_board, lambda game_state: game_state.check_match()),
+        "check_game_over": (board, lambda game_state: game_state.check_game_over()),
+        "free_column": (board, lambda game_state: game_state.free_column(game_state.free_column_count() // 2)
+                        if game_state.free_column_count() else None),
+        "create_empty_field": (lambda rows, columns, density, seed: (rows, columns),
+                               lambda size: create_empty_field(*size) if backend == "list"
+                               else make_game_state(backend, *size, None)),
+        "tick": (playable_simulation, lambda simulation: simulation.step()),
+    }
+
+
+def run_benchmarks(sizes: list[tuple[int, int]] = _SIZES, densities: list[float] = _DENSITIES,
+                   backends: list[str] = None, names: list[str] = None,
+                   repeat: int = _REPEAT, seed: int = 0) -> dict:
+    '''
+    Times every benchmark for each backend, board size and fill density and
+    returns the results with some information about the machine they ran on
+    '''
+    if backends is None:
+        backends = ["list", "sparse"] + (["array"] if ArrayGameState is not None else [])
+
+    results = []
+    for backend in backends:
+        for name, (setup, run) in _cases(backend).items():
+            if names is not None and name not in names:
+                continue
+
+            for rows, columns in sizes:
+                for density in densities:
+                    timings = []
+                    for i in range(repeat):
+                        subject = setup(rows, columns, density, seed + i)
+                        start = time.perf_counter()
+                        run(subject)
+                        timings.append(time.perf_counter() - start)
+
+                    results.append({"benchmark": name, "backend": backend,
+                                    "rows": rows, "columns": columns, "density": density,
+                                    "repeat": repeat, "min_s": min(timings),
+                                    "median_s": statistics.median(timings),
+                                    "mean_s": statistics.mean(timings)})
+                    print(f"{name:>18} {backend:>5} {rows:>5}x{columns:<5} density {density:<4} "
+                          f"median {results[-1]['median_s'] * 1000:10.3f} ms", file=sys.stderr)
+
+    return {"python": platform.python_version(), "platform": platform.platform(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"), "results": results}
+
+
+def compare(old: dict, new: dict, threshold: float = _THRESHOLD) -> list[dict]:
+    '''
+    Compares the fastest timings of two benchmark runs (the least noisy
+    statistic) and returns every case that is present in both, with its
+    slowdown ratio (new / old) and whether it regressed by more than the threshold
+    '''
+    def key(result):
+        return (result["benchmark"], result["backend"], result["rows"], result["columns"], result["density"])
+
+    old_results = {key(result): result for result in old["results"]}
+    comparisons = []
+    for result in new["results"]:
+        previous = old_results.get(key(result))
+        if previous is None or previous["min_s"] == 0:
+            continue
+
+        ratio = result["min_s"] / previous["min_s"]
+        comparisons.append({"benchmark": result["benchmark"], "backend": result["backend"],
+                            "rows": result["rows"], "columns": result["columns"], "density": result["density"],
+                            "old_min_s": previous["min_s"], "new_min_s": result["min_s"],
+                            "ratio": ratio, "regressed": ratio > 1 + threshold})
+    return comparisons
+
+
+def _size(text: str) -> tuple[int, int]:
+    '''Parses a board size given as ROWSxCOLUMNS'''
+    rows, columns = text.lower().split("x")
+    return int(rows), int(columns)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks the game mechanics hot paths")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="run the benchmarks and write the results as JSON")
+    run_parser.add_argument("--sizes", type=_size, nargs="+", default=_SIZES, metavar="ROWSxCOLUMNS")
+    run_parser.add_argument("--densities", type=float, nargs="+", default=_DENSITIES)
+    run_parser.add_argument("--backends", nargs="+", choices=["list", "array", "sparse"])
+    run_parser.add_argument("--only", nargs="+", metavar="BENCHMARK", help="run only these benchmarks")
+    run_parser.add_argument("--repeat", type=int, default=_REPEAT)
+    run_parser.add_argument("--seed", type=int, default=0)
+    run_parser.add_argument("--output", "-o", help="file to write the results to (default: stdout)")
+
+    compare_parser = subparsers.add_parser("compare", help="compare two result files")
+    compare_parser.add_argument("old")
+    compare_parser.add_argument("new")
+    compare_parser.add_argument("--threshold", type=float, default=_THRESHOLD,
+                                help="slowdown ratio above 1 that counts as a regression (default: 0.10)")
+    args = parser.parse_args()
+
+    if args.command == "run":
+        report = run_benchmarks(args.sizes, args.densities, args.backends, args.only, args.repeat, args.seed)
+        if args.output:
+            with open(args.output, "w") as file:
+                json.dump(report, file, indent=2)
+        else:
+            json.dump(report, sys.stdout, indent=2)
+    else:
+        with open(args.old) as old_file, open(args.new) as new_file:
+            comparisons = compare(json.load(old_file), json.load(new_file), args.threshold)
+
+        for comparison in comparisons:
+            flag = "REGRESSED" if comparison["regressed"] else ""
+            print(f"{comparison['benchmark']:>18} {comparison['backend']:>5} "
+                  f"{comparison['rows']:>5}x{comparison['columns']:<5} density {comparison['density']:<4} "
+                  f"{comparison['old_min_s'] * 1000:10.3f} -> {comparison['new_min_s'] * 1000:10.3f} ms "
+                  f"x{comparison['ratio']:.2f} {flag}")
+
+        sys.exit(1 if any(comparison["regressed"] for comparison in comparisons) else 0)
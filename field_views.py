@@ -0,0 +1,53 @@
+from game_mechanics import Jewel
+
+
+class RowView():
+    '''
+    A row of a field that is not stored as a nested list: cells are read with
+    the game state's _cell(row, col) and written with its _put(row, col, jewel)
+    '''
+    def __init__(self, game_state: 'GameState', row: int) -> None:
+        self._game_state = game_state
+        self._row = row
+
+    def __len__(self) -> int:
+        return self._game_state.columns()
+
+    def __getitem__(self, col: int) -> Jewel:
+        if col < 0:
+            col += self._game_state.columns()
+        if not 0 <= col < self._game_state.columns():
+            raise IndexError("column index out of range")
+        return self._game_state._cell(self._row, col)
+
+    def __setitem__(self, col: int, jewel: Jewel) -> None:
+        self._game_state._put(self._row, col, jewel)
+
+    def __iter__(self):
+        for col in range(self._game_state.columns()):
+            yield self._game_state._cell(self._row, col)
+
+
+class FieldView():
+    '''
+    A field that is not stored as a nested list, indexed like list[list[Jewel]]
+    (rows, including the two hidden rows, then columns)
+    '''
+    def __init__(self, game_state: 'GameState') -> None:
+        self._game_state = game_state
+
+    def __len__(self) -> int:
+        return self._game_state.rows() + 2
+
+    def __getitem__(self, row: int or slice) -> RowView or list[RowView]:
+        if isinstance(row, slice):
+            return [RowView(self._game_state, r) for r in range(len(self))[row]]
+        if row < 0:
+            row += len(self)
+        if not 0 <= row < len(self):
+            raise IndexError("row index out of range")
+        return RowView(self._game_state, row)
+
+    def __iter__(self):
+        for row in range(len(self)):
+            yield RowView(self._game_state, row)
@@ -1,31 +1,151 @@
+from collections import OrderedDict
+from collections.abc import Iterable, Iterator
+from enum import IntEnum
+from typing import NamedTuple
+
+
+class State(IntEnum):
+    FROZEN = 0
+    FALLING = 1
+    LANDED = 2
+    MATCHED = 3
+
+
+_COLORS = [" "]
+_COLOR_CODES = {" ": 0}
+_HASH_MASK = (1 << 64) - 1
+_ZOBRIST_TABLE_LIMIT = 1 << 16
+_CASCADE_CACHE_SIZE = 4096
+
+
+def color_code(color: str) -> int:
+    '''
+    Returns the small integer code of the given Jewel color (0 for an empty cell),
+    assigning the next free code the first time a color is seen
+    '''
+    code = _COLOR_CODES.get(color)
+    if code is None:
+        if len(_COLORS) > 255:
+            raise ValueError("at most 255 Jewel colors are supported")
+        code = len(_COLORS)
+        _COLORS.append(color)
+        _COLOR_CODES[color] = code
+        _zobrist_table.append([zobrist_key(index, code) for index in range(len(_zobrist_table[0]))])
+    return code
+
+
+def color_of(code: int) -> str:
+    '''Returns the Jewel color that the given color code stands for'''
+    return _COLORS[code]
+
+
+def known_colors() -> list[str]:
+    '''Returns every color that has been given a color code, indexed by its code'''
+    return list(_COLORS)
+
+
+def zobrist_key(index: int, code: int) -> int:
+    '''
+    Returns the 64-bit Zobrist key of the given color code in the cell with the
+    given index (row * columns + column); an empty cell's key is 0
+
+    Keys are mixed from the index and code (splitmix64) rather than drawn at
+    random, so boards of any size always hash the same way
+    '''
+    if code == 0:
+        return 0
+    key = ((index << 8 | code) + 0x9E3779B97F4A7C15) & _HASH_MASK
+    key = ((key ^ key >> 30) * 0xBF58476D1CE4E5B9) & _HASH_MASK
+    key = ((key ^ key >> 27) * 0x94D049BB133111EB) & _HASH_MASK
+    return key ^ key >> 31
+
+
+_zobrist_table = [[]]
+
+
+def zobrist_table(cells: int) -> list[list[int]] or None:
+    '''
+    Returns the shared table of Zobrist keys, indexed [color code][cell index],
+    grown to cover at least the given number of cells; returns None for boards
+    with more than _ZOBRIST_TABLE_LIMIT cells, whose keys are mixed as needed
+    '''
+    if cells > _ZOBRIST_TABLE_LIMIT:
+        return None
+
+    covered = len(_zobrist_table[0])
+    if cells > covered:
+        for code, keys in enumerate(_zobrist_table):
+            keys.extend(zobrist_key(index, code) for index in range(covered, cells))
+    return _zobrist_table
+
+
 class Jewel():
+    '''
+    A Jewel stores its color as a small integer code and its state as a State,
+    in slots rather than a __dict__
+
+    Every empty cell shares the single EMPTY Jewel: EMPTY returns it
+    instead of allocating a new object, and copying or pickling it gives back
+    EMPTY itself; other Jewels are copied and pickled by color and state
+    '''
+    __slots__ = ("_code", "_state")
+
+    def __new__(cls, color: str) -> 'Jewel':
+        if color == " " and EMPTY is not None:
+            return EMPTY
+        return super().__new__(cls)
+
     def __init__(self, color: str) -> None:
-        self._color = color
-        self._state = "FROZEN"
+        self._code = color_code(color)
+        self._state = State.FROZEN
+
+    def __reduce__(self) -> str or tuple:
+        if self is EMPTY:
+            return "EMPTY"
+        return Jewel, (self.color(),), int(self._state)
+
+    def __setstate__(self, state: int) -> None:
+        self._state = State(state)
 
     def color(self) -> str:
         '''Returns the color of a Jewel'''
-        return self._color
-    
-    def state(self) -> str:
+        return _COLORS[self._code]
+
+    def code(self) -> int:
+        '''Returns the color code of a Jewel (0 for an empty cell)'''
+        return self._code
+
+    def state(self) -> State:
         '''Returns the state of a Jewel'''
         return self._state
 
-    def update_state(self, state: str) -> None:
+    def update_state(self, state: State) -> None:
         '''Updates the state of a Jewel'''
         self._state = state
 
 
+class _EmptyJewel(Jewel):
+    __slots__ = ()
+
+    def update_state(self, state: State) -> None:
+        '''The shared empty cell is always FROZEN, so its state is never updated'''
+        pass
+
+
+EMPTY = None  # Jewel.__new__ checks EMPTY, so it must exist before the sentinel is created
+EMPTY = _EmptyJewel(" ")
+
+
 class Faller():
     def __init__(self, game_state: 'GameState', col: int, top: Jewel, middle: Jewel, bottom: Jewel) -> None:
         self._game_state = game_state
         self._row = 2
         self._col = col - 1
-        top.update_state("FALLING")
-        middle.update_state("FALLING")
-        bottom.update_state("FALLING")
+        top.update_state(State.FALLING)
+        middle.update_state(State.FALLING)
+        bottom.update_state(State.FALLING)
         self._components = [top, middle, bottom]
-        self._state = "FALLING"
+        self._state = State.FALLING
 
     def col(self) -> int:
         '''Returns the column that the Faller is in'''
@@ -35,7 +155,7 @@ class Faller():
         '''Returns a list of the Faller components (Jewels in the Faller)'''
         return self._components
 
-    def state(self) -> str:
+    def state(self) -> State:
         '''Returns the state of the Faller'''
         return self._state
 
@@ -46,8 +166,8 @@ class Faller():
                 self._col -= 1
         
                 for i, j in zip(range(3), range(2, -1, -1)):
-                    self._game_state._field[self._row - i][self._col + 1] = Jewel(" ")
-                    self._game_state._field[self._row - i][self._col] = self._components[j]
+                    self._game_state._set_cell(self._row - i, self._col + 1, EMPTY)
+                    self._game_state._set_cell(self._row - i, self._col, self._components[j])
 
     def move_right(self) -> None:
         '''Moves the Faller right once, given that there is space'''
@@ -56,23 +176,23 @@ class Faller():
                 self._col += 1
 
                 for i, j in zip(range(3), range(2, -1, -1)):
-                    self._game_state._field[self._row - i][self._col - 1] = Jewel(" ")
-                    self._game_state._field[self._row - i][self._col] = self._components[j]
+                    self._game_state._set_cell(self._row - i, self._col - 1, EMPTY)
+                    self._game_state._set_cell(self._row - i, self._col, self._components[j])
 
     def rotate(self) -> None:
         '''Rotates the Jewels once within the Faller'''
-        if self._state != "FROZEN":
+        if self._state != State.FROZEN:
             bottom = self._components[2]
             self._components[2] = self._components[1]
             self._components[1] = self._components[0]
             self._components[0] = bottom
 
         for i, j in zip(range(3), range(2, -1, -1)):
-            self._game_state._field[self._row - i][self._col] = self._components[j]
+            self._game_state._set_cell(self._row - i, self._col, self._components[j])
 
     def check_if_landed(self) -> None:
         '''Checks if the Faller landed and updates its state to LANDED if it did'''
-        if self._state == "FALLING":
+        if self._state == State.FALLING:
             if self._row + 1 == self._game_state.rows() + 2:
                 self._landed()
             elif self._game_state.field()[self._row + 1][self._col].color() != " ":
@@ -83,30 +203,173 @@ class Faller():
         Checks if the Faller was moved to a spot with a space under it
         and updates its state to FALLING if it was
         '''
-        if self._state == "LANDED":
+        if self._state == State.LANDED:
             if self._row < self._game_state.rows() - 1:
                 if self._game_state.field()[self._row + 1][self._col].color() == " ":
                     self._falling()
 
     def frozen(self) -> None:
         '''Updates the state of the Faller and the Jewels within that Faller to FROZEN'''
-        if self._state == "LANDED":
-            self._state = "FROZEN"
+        if self._state == State.LANDED:
+            self._state = State.FROZEN
             for jewel in self._components:
-                jewel.update_state("FROZEN")
+                jewel.update_state(State.FROZEN)
             self._game_state._faller = None
 
     def _falling(self) -> None:
         '''Updates the state of the Faller and the Jewels within that Faller to FALLING'''
-        self._state = "FALLING"
+        self._state = State.FALLING
         for jewel in self._components:
-            jewel.update_state("FALLING")
+            jewel.update_state(State.FALLING)
 
     def _landed(self) -> None:
         '''Updates the state of the Faller and the Jewels within that Faller to LANDED'''
-        self._state = "LANDED"
+        self._state = State.LANDED
         for jewel in self._components:
-            jewel.update_state("LANDED")
+            jewel.update_state(State.LANDED)
+
+
+class FallerSnapshot(NamedTuple):
+    row: int
+    col: int
+    state: State
+    codes: tuple[int, int, int]
+    states: tuple[State, State, State]
+    cell_rows: tuple[int, int, int]
+
+
+class Snapshot(NamedTuple):
+    '''
+    An immutable copy of a GameState: cells holds the color code of every cell
+    of the field (row by row) followed by the state of every cell; cell_rows in
+    the FallerSnapshot are the rows holding the Faller's Jewels (-1 if one is
+    not in the field)
+    '''
+    rows: int
+    columns: int
+    cells: bytes
+    faller: FallerSnapshot or None
+    game_over: bool
+
+
+class CascadeStep(NamedTuple):
+    cleared: tuple[tuple[int, int], ...]
+    moves: tuple[tuple[int, int, int], ...]
+
+
+class CascadeOutcome(NamedTuple):
+    cells: bytes or None
+    board_hash: int
+    jewels_cleared: int
+    chain: int
+    steps: tuple[CascadeStep, ...]
+
+
+class CascadeCache():
+    '''
+    A bounded transposition table mapping the Zobrist hash of a settled board
+    (no Faller) to the outcome of resolving its cascade; the least recently
+    used entry is evicted once the cache is full
+    '''
+    def __init__(self, max_size: int = _CASCADE_CACHE_SIZE) -> None:
+        self._max_size = max_size
+        self._entries = OrderedDict()
+        self._hits = 0
+        self._misses = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: tuple) -> CascadeOutcome or None:
+        '''Returns the cached outcome for the given key, or None if it is not cached'''
+        outcome = self._entries.get(key)
+        if outcome is None:
+            self._misses += 1
+        else:
+            self._hits += 1
+            self._entries.move_to_end(key)
+        return outcome
+
+    def put(self, key: tuple, outcome: CascadeOutcome) -> None:
+        '''Caches an outcome, evicting the least recently used one if the cache is full'''
+        self._entries[key] = outcome
+        self._entries.move_to_end(key)
+        if len(self._entries) > self._max_size:
+            self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        '''Removes every cached outcome'''
+        self._entries.clear()
+
+    def stats(self) -> dict[str, int]:
+        '''Returns the number of cached outcomes, hits and misses'''
+        return {"size": len(self._entries), "hits": self._hits, "misses": self._misses}
+
+
+class ColumnSet():
+    '''
+    An ordered set of column indices, stored as a membership flag per column and
+    a Fenwick tree of the flags: size and membership are O(1); adding, removing
+    and finding the n-th smallest member are O(log columns)
+    '''
+    def __init__(self, columns: int, members: Iterable[int] = ()) -> None:
+        self._mask = bytearray(columns)
+        for col in members:
+            self._mask[col] = 1
+        self._count = sum(self._mask)
+
+        self._tree = [0] * (columns + 1)
+        for i in range(1, columns + 1):
+            self._tree[i] += self._mask[i - 1]
+            parent = i + (i & -i)
+            if parent <= columns:
+                self._tree[parent] += self._tree[i]
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __contains__(self, col: int) -> bool:
+        return self._mask[col] == 1
+
+    def mask(self) -> bytearray:
+        '''Returns the membership flag (0 or 1) of every column; it must not be modified'''
+        return self._mask
+
+    def add(self, col: int) -> None:
+        '''Adds a column to the set, if it is not in it already'''
+        if not self._mask[col]:
+            self._mask[col] = 1
+            self._count += 1
+            self._update(col, 1)
+
+    def discard(self, col: int) -> None:
+        '''Removes a column from the set, if it is in it'''
+        if self._mask[col]:
+            self._mask[col] = 0
+            self._count -= 1
+            self._update(col, -1)
+
+    def nth(self, index: int) -> int:
+        '''Returns the member with the given (0-based) index in ascending order'''
+        if not 0 <= index < self._count:
+            raise IndexError("column set index out of range")
+
+        position = 0
+        remaining = index + 1
+        step = 1 << (len(self._mask).bit_length() - 1)
+        while step:
+            if position + step <= len(self._mask) and self._tree[position + step] < remaining:
+                position += step
+                remaining -= self._tree[position]
+            step >>= 1
+        return position
+
+    def _update(self, col: int, amount: int) -> None:
+        '''Adds the amount to the counts of every tree node covering the column'''
+        i = col + 1
+        while i <= len(self._mask):
+            self._tree[i] += amount
+            i += i & -i
 
 
 class GameState():
@@ -116,6 +379,16 @@ class GameState():
         self._field = field
         self._faller = None
         self._game_over = False
+        self._dirty = set()
+        self._all_dirty = True
+        self._keys = zobrist_table((rows + 2) * columns)
+        self._hash = self._full_hash() if field is not None else 0
+        self._matched_count = self._count_matched() if field is not None else 0
+        self._heights = [0] * columns
+        self._free_columns = ColumnSet(columns, range(columns))
+        self._hidden = set()
+        if field is not None:
+            self._build_index()
 
     def rows(self) -> int:
         '''Returns the number of rows in the visible field'''
@@ -137,6 +410,70 @@ class GameState():
         '''Returns the True if the game is over and False if not'''
         return self._game_over
 
+    def end_game(self) -> None:
+        '''Ends the game, e.g. when there is no column left for a new Faller'''
+        self._game_over = True
+
+    def board_hash(self) -> int:
+        '''
+        Returns the Zobrist hash of the colors in the field (including the hidden
+        rows and the Faller's Jewels, but not the Jewels' states); it is kept up
+        to date as cells are written, so reading it is O(1)
+        '''
+        return self._hash
+
+    def column_height(self, col: int) -> int:
+        '''Returns the number of Jewels in a column of the field (including the hidden rows)'''
+        return self._heights[col]
+
+    def free_column_count(self) -> int:
+        '''Returns the number of columns with space for a new Faller (their top visible cell is empty)'''
+        return len(self._free_columns)
+
+    def free_column(self, index: int) -> int:
+        '''
+        Returns the column with space for a new Faller that has the given (0-based)
+        index among those columns, from left to right
+        '''
+        return self._free_columns.nth(index)
+
+    def snapshot(self) -> Snapshot:
+        '''Returns an immutable copy of the field, the Faller and the game over flag'''
+        faller = None
+        if self._faller != None:
+            components = self._faller.components()
+            faller = FallerSnapshot(self._faller._row, self._faller.col(), self._faller.state(),
+                                    tuple(jewel.code() for jewel in components),
+                                    tuple(jewel.state() for jewel in components),
+                                    tuple(self._faller_cell_rows()))
+
+        return Snapshot(self._rows, self._columns, self._cells(), faller, self._game_over)
+
+    def restore(self, snapshot: Snapshot) -> None:
+        '''Restores the field, the Faller and the game over flag from a snapshot of a game of the same size'''
+        if (snapshot.rows, snapshot.columns) != (self._rows, self._columns):
+            raise ValueError(f"cannot restore a {snapshot.rows}x{snapshot.columns} snapshot "
+                             f"into a {self._rows}x{self._columns} game")
+
+        self._faller = None
+        self._load_cells(snapshot.cells)
+        self._build_index()
+        self._hash = self._full_hash()
+        self._matched_count = snapshot.cells[(self._rows + 2) * self._columns:].count(State.MATCHED)
+        self._game_over = snapshot.game_over
+        self._dirty = set()
+        self._all_dirty = True
+
+        if snapshot.faller is not None:
+            saved = snapshot.faller
+            faller = Faller(self, saved.col + 1, *self._faller_components(saved))
+            faller._row = saved.row
+            faller._state = saved.state
+            for jewel, state in zip(faller.components(), saved.states):
+                jewel.update_state(State(state))
+            self._faller = faller
+            self._faller_restored(saved)
+
     def place_faller(self, faller: Faller) -> None:
         '''
         Updates the game state with a Faller and places the Faller in the field
@@ -145,132 +482,341 @@ class GameState():
         the _game_over attribute is set to True
         '''
         self._faller = faller
-        if self._field[2][faller.col()].color() == " ":
+        if faller.col() in self._free_columns:
             for i in range(3):
-                self._field[i][faller.col()] = faller.components()[i]
+                self._set_cell(i, faller.col(), faller.components()[i])
             faller.check_if_landed()
         else:
             self._game_over = True
 
-    def normal_gravity(self) -> None:
-        '''Drops every Jewel to the bottom of the field, leaving no spaces under them'''
+    def normal_gravity(self) -> list[list[tuple[int, int]]]:
+        '''
+        Drops every Jewel to the bottom of the field, leaving no spaces under them
+
+        Each column is compacted in a single pass from the bottom up; returns,
+        for every column, the (from_row, to_row) pairs of the Jewels that moved
+        '''
+        moves = []
         for c in range(self._columns):
-            for row_count in range(self._rows + 1):
-                for r in range(self._rows + 1):
-                    if self._field[r][c].color() != " " and self._field[r + 1][c].color() == " ":
-                        self._field[r + 1][c] = self._field[r][c]
-                        self._field[r][c] = Jewel(" ")
-
-    def tick_gravity(self) -> None:
-        '''Drops every Jewel/Faller in the field once, given that there is a space under it'''
+            column_moves = []
+            bottom = self._rows + 1
+
+            for r in reversed(range(self._rows + 2)):
+                if self._field[r][c] is not EMPTY:
+                    if r != bottom:
+                        self._swap_cells(r, bottom, c)
+                        column_moves.append((r, bottom))
+                    bottom -= 1
+
+            moves.append(column_moves)
+        return moves
+
+    def tick_gravity(self) -> list[list[tuple[int, int]]]:
+        '''
+        Drops every Jewel/Faller in the field once, given that there is a space under it
+
+        A Jewel drops when there is any space below it in its column, so each column
+        is handled in a single pass from the bottom up; returns, for every column,
+        the (from_row, to_row) pairs of the Jewels that moved
+        '''
+        moves = []
         for c in range(self._columns):
-            for r in reversed(range(self._rows + 1)):
-                if self._field[r][c].color() != " " and self._field[r + 1][c].color() == " ":
-                    self._field[r + 1][c] = self._field[r][c]
-                    self._field[r][c] = Jewel(" ")
+            column_moves = []
+            space_below = False
+
+            for r in reversed(range(self._rows + 2)):
+                if self._field[r][c] is EMPTY:
+                    space_below = True
+                elif space_below:
+                    self._swap_cells(r, r + 1, c)
+                    column_moves.append((r, r + 1))
+
+            moves.append(column_moves)
 
-        if self._faller != None and self._faller.state() == "FALLING":
+        if self._faller != None and self._faller.state() == State.FALLING:
             self._faller._row += 1
 
+        return moves
+
     def check_game_over(self) -> None:
         '''
         Checks if the game is over and updates the _game_over attribute to True if it is
         
         The game is over when every Jewel in the field is frozen, not matched, and there is
-        a Jewel or part of a Faller existing above the visible field
+        a Jewel or part of a Faller existing above the visible field; only the columns
+        with a Jewel in the hidden rows are looked at
         '''
         if not self.check_match():
-            for i in range(self._columns):
-                if self._field[0][i].color() != " " or self._field[1][i].color() != " ":
-                    if self._field[0][i].state() == "FROZEN" or self._field[1][i].state() == "FROZEN":
-                        self._game_over = True
+            for i in {c for _, c in self._hidden}:
+                if self._field[0][i].state() == State.FROZEN or self._field[1][i].state() == State.FROZEN:
+                    self._game_over = True
 
     def check_match(self) -> bool:
-        '''Checks if any Jewels in the field are matched'''
-        for r in range(self._rows + 2):
-            for c in range(self._columns):
-                if self._field[r][c].state() == "MATCHED":
-                    return True
-        return False
+        '''
+        Checks if any Jewels in the field are matched; the matched Jewels are
+        counted as match() marks them, so this does not scan the field
+        '''
+        return self._matched_count > 0
 
     def remove_matches(self) -> None:
         '''Removes matched Jewels from the field'''
         for r in range(self._rows + 2):
             for c in range(self._columns):
-                if self._field[r][c].state() == "MATCHED":
-                    self._field[r][c] = Jewel(" ")
-
-    def match(self) -> None:
-        '''Traverses through the field and checks each Jewel for matching sequences'''
-        for row in range(self._rows + 2):
-            for col in range(self._columns):
-                self._matching_sequence_begins_at(row, col)
+                if self._field[r][c].state() == State.MATCHED:
+                    self._set_cell(r, c, EMPTY)
+        self._matched_count = 0
 
-    def _matching_sequence_begins_at(self, row: int, col: int) -> None:
+    def match(self, incremental: bool = False) -> set[tuple[int, int]]:
         '''
-        Checks if there is a matching sequence of Jewels in the field
-        beginning in the given column and row and extending in any of the
-        eight possible directions
+        Marks every Jewel that is part of a horizontal, vertical or diagonal line
+        of three or more matching Jewels as MATCHED and returns the set of
+        (row, column) coordinates that were matched
+
+        Every row, column and diagonal of the field is scanned once; if incremental
+        is True, only the lines passing through cells that changed since the last
+        match are scanned, since no other line can hold a new match
         '''
-        self._three_in_a_row(row, col, 0, 1) \
-        or self._three_in_a_row(row, col, 1, 1) \
-        or self._three_in_a_row(row, col, 1, 0) \
-        or self._three_in_a_row(row, col, 1, -1) \
-        or self._three_in_a_row(row, col, 0, -1) \
-        or self._three_in_a_row(row, col, -1, -1) \
-        or self._three_in_a_row(row, col, -1, 0) \
-        or self._three_in_a_row(row, col, -1, 1)
-        
+        if incremental and not self._all_dirty:
+            lines = {line for r, c in self._dirty for line in ((0, r), (1, c), (2, r - c), (3, r + c))}
+        else:
+            lines = self._lines()
+
+        matched = set()
+        for direction, index in lines:
+            self._match_runs(self._line(direction, index), matched)
+
+        for r, c in matched:
+            jewel = self._field[r][c]
+            if jewel.state() != State.MATCHED:
+                jewel.update_state(State.MATCHED)
+                self._matched_count += 1
 
-    def _three_in_a_row(self, row: int, col: int, rowdelta: int, coldelta: int) -> None:
+        self._dirty = set()
+        self._all_dirty = False
+        return matched
+
+    def resolve_cascade(self, cache: CascadeCache = None) -> CascadeOutcome:
+        '''
+        Resolves the cascade of a board with no Faller at once: matches, removes
+        the matched Jewels and drops the rest until nothing matches; returns the
+        final board, the number of Jewels cleared, the chain length and, for every
+        step of the chain, the cells it cleared and the (column, from_row, to_row)
+        moves of the Jewels that fell, so that a UI can animate it at its own pace
+
+        With a cache, a board that was resolved before is restored from it
+        instead of running match and gravity again; the final board's cells
+        are only copied into the outcome when there is a cache to keep them
+        '''
+        if self._faller != None:
+            raise ValueError("cannot resolve a cascade while there is a Faller")
+
+        key = (self._rows, self._columns, self._hash)
+        if cache is not None:
+            outcome = cache.get(key)
+            if outcome is not None:
+                self._load_cells(outcome.cells)
+                self._build_index()
+                self._hash = outcome.board_hash
+                self._matched_count = 0
+                self._dirty = set()
+                self._all_dirty = True
+                return outcome
+
+        steps = []
+        while True:
+            matched = self.match(incremental=len(steps) > 0 or self._matched_count == 0)
+            if not matched:
+                break
+            self.remove_matches()
+            moves = self.normal_gravity()
+            steps.append(CascadeStep(tuple(sorted(matched)),
+                                     tuple((c, from_row, to_row) for c, column_moves in enumerate(moves)
+                                           for from_row, to_row in column_moves)))
+
+        outcome = CascadeOutcome(self._cells() if cache is not None else None, self._hash, sum(len(step.cleared) for step in steps),
+                                 len(steps), tuple(steps))
+        if cache is not None:
+            cache.put(key, outcome)
+        return outcome
+
+    def _build_index(self) -> None:
+        '''
+        Rebuilds the column heights, the free columns (whose top visible cell is
+        empty) and the Jewels in the hidden rows from every cell; from then on they
+        are kept up to date as cells are written
         '''
-        Checks if there is a matching sequence of Jewels in the field
-        beginning in the given column and row and extending in a direction
-        specified by the coldelta and rowdelta
-
-        Updates the states of the matched Jewels in the field to MATCHED
-        ''' 
-        start_cell = self._field[row][col].color()
-        matched = []
-
-        if start_cell != " ":
-            for i in range(1, 3):
-                if self._is_valid_row_number(row + rowdelta * i) \
-                        and self._is_valid_column_number(col + coldelta * i) \
-                        and self._field[row + rowdelta * i][col + coldelta *i].color() == start_cell:
-                    matched.append(self._field[row + rowdelta * i][col + coldelta * i])
+        self._heights = [0] * self._columns
+        for row in self._field:
+            for c, jewel in enumerate(row):
+                if jewel.code() != 0:
+                    self._heights[c] += 1
+
+        self._free_columns = ColumnSet(self._columns, (c for c in range(self._columns)
+                                                         if self._field[2][c].code() == 0))
+        self._hidden = {(r, c) for r in range(2) for c in range(self._columns) if self._field[r][c].code() != 0}
+
+    def _index_cell(self, row: int, col: int, occupied: bool) -> None:
+        '''Updates the free columns or the Jewels in the hidden rows after a cell in the top three rows was filled or emptied'''
+        if row == 2:
+            if occupied:
+                self._free_columns.discard(col)
+            else:
+                self._free_columns.add(col)
+        elif row < 2:
+            if occupied:
+                self._hidden.add((row, col))
+            else:
+                self._hidden.discard((row, col))
+
+    def _count_matched(self) -> int:
+        '''Returns the number of matched Jewels in the field, counted from every cell'''
+        return sum(1 for row in self._field for jewel in row if jewel.state() == State.MATCHED)
+
+    def _full_hash(self) -> int:
+        '''Returns the Zobrist hash of the colors in the field, computed from every cell'''
+        board_hash = 0
+        for r, row in enumerate(self._field):
+            for c, jewel in enumerate(row):
+                if self._keys is not None:
+                    board_hash ^= self._keys[jewel.code()][r * self._columns + c]
                 else:
-                    matched = []
-                    break
+                    board_hash ^= zobrist_key(r * self._columns + c, jewel.code())
+        return board_hash
+
+    def _cells(self) -> bytes:
+        '''Returns the color codes of every cell of the field followed by their states'''
+        codes = bytes([jewel.code() for row in self._field for jewel in row])
+        states = bytes([jewel.state() for row in self._field for jewel in row])
+        return codes + states
+
+    def _load_cells(self, cells: bytes) -> None:
+        '''Replaces the field with new Jewels built from color codes and states as returned by _cells'''
+        size = (self._rows + 2) * self._columns
+        field = []
+        for r in range(self._rows + 2):
+            row = []
+            for i in range(r * self._columns, (r + 1) * self._columns):
+                jewel = Jewel(color_of(cells[i]))
+                jewel.update_state(State(cells[size + i]))
+                row.append(jewel)
+            field.append(row)
+        self._field = field
+
+    def _faller_cell_rows(self) -> list[int]:
+        '''Returns the row of the field holding each of the Faller's Jewels, or -1 for one that is not in the field'''
+        column = [row[self._faller.col()] for row in self._field]
+        return [next((r for r, cell in enumerate(column) if cell is jewel), -1)
+                for jewel in self._faller.components()]
+
+    def _faller_components(self, saved: FallerSnapshot) -> list[Jewel]:
+        '''Returns the Jewels of a restored Faller: the ones in its cells of the field, or new ones'''
+        return [self._field[r][saved.col] if r >= 0 else Jewel(color_of(code))
+                for code, r in zip(saved.codes, saved.cell_rows)]
+
+    def _faller_restored(self, saved: FallerSnapshot) -> None:
+        '''Called after a Faller was restored; backends that track the Faller's cells update them here'''
+        pass
+
+    def _set_cell(self, row: int, col: int, jewel: Jewel) -> None:
+        '''Places the given Jewel in a cell of the field, marks the cell as changed and updates the hash'''
+        old_code = self._field[row][col].code()
+        new_code = jewel.code()
+        if old_code != new_code:
+            index = row * self._columns + col
+            if self._keys is not None:
+                self._hash ^= self._keys[old_code][index] ^ self._keys[new_code][index]
+            else:
+                self._hash ^= zobrist_key(index, old_code) ^ zobrist_key(index, new_code)
+            if (old_code == 0) != (new_code == 0):
+                self._heights[col] += 1 if old_code == 0 else -1
+                if row < 3:
+                    self._index_cell(row, col, new_code != 0)
+        self._field[row][col] = jewel
+        self._dirty.add((row, col))
+
+    def _swap_cells(self, row: int, other_row: int, col: int) -> None:
+        '''
+        Swaps the contents of two cells in the same column of the field, marking
+        both as changed; the hash is updated once for the pair rather than per cell,
+        and the column's height cannot change
+        '''
+        field = self._field
+        jewel = field[row][col]
+        other = field[other_row][col]
+        field[row][col] = other
+        field[other_row][col] = jewel
+        self._dirty.add((row, col))
+        self._dirty.add((other_row, col))
+
+        code = jewel.code()
+        other_code = other.code()
+        if code != other_code:
+            index = row * self._columns + col
+            other_index = other_row * self._columns + col
+            if self._keys is not None:
+                keys, other_keys = self._keys[code], self._keys[other_code]
+                self._hash ^= keys[index] ^ keys[other_index] ^ other_keys[index] ^ other_keys[other_index]
             else:
-                for r in range(self._rows + 2):
-                    for c in range(self._columns):
-                        for match in matched:
-                            
-                            if match == self._field[r][c]:
-                                self._field[r][c].update_state("MATCHED")
-                matched = []
+                self._hash ^= (zobrist_key(index, code) ^ zobrist_key(other_index, code)
+                               ^ zobrist_key(index, other_code) ^ zobrist_key(other_index, other_code))
+            if (row < 3 or other_row < 3) and (code == 0) != (other_code == 0):
+                self._index_cell(row, col, other_code != 0)
+                self._index_cell(other_row, col, code != 0)
+
+    def _lines(self) -> Iterator[tuple[int, int]]:
+        '''
+        Yields every row, column and diagonal (in both directions) of the field
+        that is long enough to hold three Jewels, as a (direction, index) pair
+        '''
+        height = self._rows + 2
+
+        for r in range(height):
+            yield 0, r
+
+        for c in range(self._columns):
+            yield 1, c
+
+        for diagonal in range(3 - self._columns, height - 2):
+            yield 2, diagonal
 
-    def _is_valid_row_number(self, row_number: int) -> bool:
-        '''Returns True if the given row number is valid; returns False otherwise'''
-        return 0 <= row_number < self._rows + 2
+        for diagonal in range(2, height + self._columns - 3):
+            yield 3, diagonal
+
+    def _line(self, direction: int, index: int) -> list[tuple[int, int]]:
+        '''
+        Returns the (row, column) coordinates of a line of the field: the row or
+        column with the given index, or the diagonal on which row - column
+        (direction 2) or row + column (direction 3) equals the index
+        '''
+        height = self._rows + 2
+
+        if direction == 0:
+            return [(index, c) for c in range(self._columns)]
+        elif direction == 1:
+            return [(r, index) for r in range(height)]
+        elif direction == 2:
+            return [(r, r - index) for r in range(max(0, index), min(height, index + self._columns))]
+        else:
+            return [(r, index - r) for r in range(max(0, index - self._columns + 1), min(height, index + 1))]
+
+    def _match_runs(self, line: list[tuple[int, int]], matched: set[tuple[int, int]]) -> None:
+        '''
+        Adds the coordinates of every run of three or more matching Jewels
+        in the given line to the matched set
+        '''
+        colors = [self._field[r][c].code() for r, c in line]
+        run_start = 0
 
-    def _is_valid_column_number(self, column_number: int) -> bool:
-        '''Returns True if the given column number is valid; returns False otherwise'''
-        return 0 <= column_number < self._columns
+        for i in range(1, len(line) + 1):
+            if i == len(line) or colors[i] != colors[run_start]:
+                if i - run_start >= 3 and colors[run_start] != 0:
+                    matched.update(line[run_start:i])
+                run_start = i
 
 
-def create_empty_field(rows: int, columns: int) -> GameState:
+def create_empty_field(rows: int, columns: int) -> list[list[Jewel]]:
     '''
-    Returns a GameState object with an empty field whose size
-    is determinedby the given row and column count
+    Returns an empty field (every cell holds the shared EMPTY Jewel) whose size
+    is determined by the given row and column count
     '''
-    field = [[Jewel(" ") for _ in range(columns)], [Jewel(" ") for _ in range(columns)]]
-    
-    for i in range(rows):
-        row = []
-        for j in range(columns):
-            row.append(Jewel(" "))
-        field.append(row)
-
-    return field
\ No newline at end of file
+    return [[EMPTY] * columns for _ in range(rows + 2)]
\ No newline at end of file
@@ -0,0 +1,197 @@
+from typing import Callable
+import functools
+import gc
+import json
+import time
+import tracemalloc
+
+
+_DUMP_INTERVAL = 1.0
+_ENGINE_METHODS = ["match", "normal_gravity", "tick_gravity", "remove_matches", "resolve_cascade"]
+
+
+class Profiler():
+    '''
+    Collects per-call timings (count, total, maximum and, optionally, memory
+    allocated) and counters for instrumented calls, both since it was created
+    and over fixed windows of time
+
+    Nothing is measured until calls are wrapped with instrument(), so the
+    game pays nothing for instrumentation it does not use. At the end of each
+    window the window's stats are kept for stats readers (e.g. an overlay)
+    and, if a dump path was given, appended to it as one JSON line
+    '''
+    def __init__(self, dump_path: str = None, dump_interval: float = _DUMP_INTERVAL) -> None:
+        self._totals = {}
+        self._window = {}
+        self._counters = {}
+        self._window_counters = {}
+        self._last_window = {"seconds": 0.0, "timings": {}, "counters": {}}
+        self._window_start = time.perf_counter()
+        self._dump_interval = dump_interval
+        self._dump_file = open(dump_path, "a") if dump_path is not None else None
+        self._wrapped = []
+        self._tracing = False
+
+    def instrument(self, owner: object, name: str, label: str = None, allocations: bool = False,
+                   counters: dict[str, Callable[[object], int]] = None) -> None:
+        '''
+        Wraps the method with the given name on a class or an instance so that
+        every call is timed under the label (the method name by default); each
+        of the counters is then added the amount its function returns for the
+        call's result
+
+        With allocations, memory allocations are traced (with tracemalloc, from
+        the first such call on, which slows every allocation down) and the peak
+        number of bytes allocated during each call is recorded too, along with
+        the garbage collections it triggered in the "gc_collections" counter;
+        calls instrumented this way should not be nested in one another
+        '''
+        original = getattr(owner, name)
+        label = label if label is not None else name
+        counters = counters if counters is not None else {}
+        record = self.record
+        count = self.count
+
+        if allocations and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._tracing = True
+
+        @functools.wraps(original)
+        def wrapper(*args, **kwargs):
+            if allocations:
+                collections = _gc_collections()
+                memory, _ = tracemalloc.get_traced_memory()
+                tracemalloc.reset_peak()
+            start = time.perf_counter()
+            try:
+                result = original(*args, **kwargs)
+            finally:
+                seconds = time.perf_counter() - start
+                if allocations:
+                    record(label, seconds, tracemalloc.get_traced_memory()[1] - memory)
+                    count("gc_collections", _gc_collections() - collections)
+                else:
+                    record(label, seconds)
+
+            for counter, amount in counters.items():
+                count(counter, amount(result))
+            return result
+
+        self._wrapped.append((owner, name, name in vars(owner), vars(owner).get(name)))
+        setattr(owner, name, wrapper)
+
+    def uninstrument(self) -> None:
+        '''Restores every method that was wrapped with instrument()'''
+        for owner, name, had_own, original in reversed(self._wrapped):
+            if had_own:
+                setattr(owner, name, original)
+            else:
+                delattr(owner, name)
+        self._wrapped = []
+
+    def record(self, label: str, seconds: float, allocated: int = None) -> None:
+        '''Records one call under the label that took the given time (and allocated up to the given bytes at its peak)'''
+        for timings in (self._totals, self._window):
+            entry = timings.get(label)
+            if entry is None:
+                entry = timings[label] = [0, 0.0, 0.0, None]
+            entry[0] += 1
+            entry[1] += seconds
+            if seconds > entry[2]:
+                entry[2] = seconds
+            if allocated is not None:
+                entry[3] = (entry[3] or 0) + allocated
+
+    def count(self, label: str, amount: int = 1) -> None:
+        '''Adds the amount to the counter with the given label'''
+        self._counters[label] = self._counters.get(label, 0) + amount
+        self._window_counters[label] = self._window_counters.get(label, 0) + amount
+
+    def stats(self) -> dict:
+        '''Returns the timings and counters recorded since the profiler was created'''
+        return {"timings": _timing_stats(self._totals), "counters": dict(self._counters)}
+
+    def window_stats(self) -> dict:
+        '''Returns the length in seconds, timings and counters of the last completed window'''
+        return self._last_window
+
+    def top(self, count: int = 5, exclude: tuple[str] = ()) -> list[tuple[str, dict]]:
+        '''
+        Returns the labels (other than the excluded ones) with the most total time
+        in the last completed window, costliest first
+        '''
+        timings = [item for item in self._last_window["timings"].items() if item[0] not in exclude]
+        return sorted(timings, key=lambda item: item[1]["total_ms"], reverse=True)[:count]
+
+    def poll(self) -> bool:
+        '''
+        Completes the current window if it has lasted the dump interval, dumping
+        its stats if there is a dump file; returns True if a window was completed
+        '''
+        now = time.perf_counter()
+        if now - self._window_start < self._dump_interval:
+            return False
+
+        self._last_window = {"seconds": now - self._window_start,
+                             "timings": _timing_stats(self._window),
+                             "counters": self._window_counters}
+        self._window = {}
+        self._window_counters = {}
+        self._window_start = now
+
+        if self._dump_file is not None:
+            self._dump_file.write(json.dumps({"time": time.time(), **self._last_window}) + "\n")
+            self._dump_file.flush()
+        return True
+
+    def close(self) -> None:
+        '''Restores the wrapped methods, stops tracing allocations if it started to, and closes the dump file'''
+        self.uninstrument()
+        if self._tracing:
+            tracemalloc.stop()
+            self._tracing = False
+        if self._dump_file is not None:
+            self._dump_file.close()
+            self._dump_file = None
+
+
+def instrument_engine(profiler: Profiler, game_state: object) -> None:
+    '''
+    Instruments the whole-board operations of a GameState (of any backend),
+    counting the Jewels matched and moved and the steps of resolved cascades
+    '''
+    for name in _ENGINE_METHODS:
+        profiler.instrument(game_state, name, counters=_ENGINE_COUNTERS.get(name))
+
+
+def _moved_count(moves: list[list[tuple[int, int]]]) -> int:
+    '''Returns the number of Jewels that a gravity pass moved'''
+    return sum(len(column_moves) for column_moves in moves)
+
+
+def _cascade_steps(outcome: object) -> int:
+    '''Returns the number of steps of a resolved cascade'''
+    return len(outcome.steps)
+
+
+def _gc_collections() -> int:
+    '''Returns the number of garbage collections (of any generation) so far'''
+    return sum(generation["collections"] for generation in gc.get_stats())
+
+
+_ENGINE_COUNTERS = {"match": {"jewels_matched": len},
+                    "normal_gravity": {"jewels_moved": _moved_count},
+                    "tick_gravity": {"jewels_moved": _moved_count},
+                    "resolve_cascade": {"cascade_steps": _cascade_steps}}
+
+
+def _timing_stats(timings: dict[str, list]) -> dict[str, dict]:
+    '''Returns raw [count, total, max, allocated] timings as dicts in milliseconds (and bytes)'''
+    stats = {}
+    for label, (count, total, longest, allocated) in timings.items():
+        stats[label] = {"count": count, "total_ms": total * 1000,
+                        "mean_ms": total * 1000 / count, "max_ms": longest * 1000}
+        if allocated is not None:
+            stats[label]["peak_bytes_per_call"] = allocated / count
+    return stats
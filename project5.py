@@ -1,13 +1,18 @@
-from game_mechanics import Jewel, Faller, GameState, create_empty_field
+from simulation import Simulation, COLUMN_COUNT, JEWEL_COLORS, ROW_COUNT
+from renderer import BoardRenderer, PerformanceOverlay
+from replay import Recorder
+from autoplayer import AutoPlayer
+from instrumentation import Profiler, instrument_engine
+from spectator import SpectatorThread
 import random
+import statistics
+import time
 import pygame
 
 
 _INIT_WIDTH = 600
 _INIT_HEIGHT = 600
 _BOARD_CELL_SIZE = 0.075
-_ROW_COUNT = 13
-_COLUMN_COUNT = 6
 _BACKGROUND_COLOR = pygame.Color(40, 40, 40)
 _BOARD_OUTLINE_COLOR = pygame.Color(255, 255, 255)
 _RED = pygame.Color(255, 0, 0)
@@ -17,15 +22,67 @@ _GREEN = pygame.Color(0, 255, 0)
 _BLUE = pygame.Color(0, 255, 255)
 _PURPLE = pygame.Color(181,126,220)
 _PINK = pygame.Color(255, 192, 203)
-_JEWEL_COLORS = ["R", "O", "Y", "G", "B", "P", "Z"]
+_RENDER_FPS = 60
+_MAX_TICKS_PER_FRAME = 5
+_OVERLAY_FONT_SIZE = 0.02
+_SPECTATE_HOST = "127.0.0.1"
+
+
+class LatencyMeter():
+    '''
+    Measures input-to-display latency: the time from when the game loop takes
+    a key press off the event queue until the frame showing its effect has
+    been pushed to the display
+    '''
+    def __init__(self) -> None:
+        self._pending = None
+        self._samples = []
+
+    def input_received(self) -> None:
+        '''Records that an input was just taken off the event queue'''
+        if self._pending is None:
+            self._pending = time.perf_counter()
+
+    def frame_displayed(self) -> None:
+        '''Records that a frame was just pushed to the display'''
+        if self._pending is not None:
+            self._samples.append(time.perf_counter() - self._pending)
+            self._pending = None
+
+    def stats(self) -> dict[str, float]:
+        '''Returns the number of samples and the mean, 95th percentile and maximum latency in milliseconds'''
+        if not self._samples:
+            return {"count": 0, "mean_ms": 0.0, "p95_ms": 0.0, "max_ms": 0.0}
+
+        samples = sorted(self._samples)
+        return {"count": len(samples),
+                "mean_ms": statistics.mean(samples) * 1000,
+                "p95_ms": samples[min(len(samples) - 1, int(len(samples) * 0.95))] * 1000,
+                "max_ms": samples[-1] * 1000}
 
 
 class Columns():
-    def __init__(self) -> None:
+    def __init__(self, render_fps: int = _RENDER_FPS, record_path: str = None, demo: bool = False,
+                 profile: bool = False, profile_path: str = None,
+                 spectate_port: int = None, spectate_host: str = _SPECTATE_HOST) -> None:
         self._running = True
-        self._fall_time = 0
         self._fall_speed = 1
-        self._game_state = GameState(_ROW_COUNT, _COLUMN_COUNT, create_empty_field(_ROW_COUNT, _COLUMN_COUNT))
+        self._render_fps = render_fps
+        self._latency = LatencyMeter()
+        seed = random.getrandbits(63)
+        self._simulation = Simulation(seed, ROW_COUNT, COLUMN_COUNT, JEWEL_COLORS)
+        self._record_path = record_path
+        self._recorder = Recorder(seed, ROW_COUNT, COLUMN_COUNT) if record_path is not None else None
+        self._game_state = self._simulation.game_state()
+        self._autoplayer = AutoPlayer(colors=JEWEL_COLORS) if demo else None
+        self._renderer = BoardRenderer((165 / _INIT_WIDTH, 7 / _INIT_HEIGHT), _BOARD_CELL_SIZE,
+                                       _BACKGROUND_COLOR, _BOARD_OUTLINE_COLOR, self._get_color)
+        self._profiler = None
+        self._overlay = None
+        self._spectate_address = (spectate_host, spectate_port) if spectate_port is not None else None
+        self._spectators = None
+        if profile or profile_path is not None:
+            self._start_profiling(profile_path)
 
     def run(self) -> None:
         '''
@@ -33,31 +90,144 @@ class Columns():
         depending on the various events from the user, and advances (ticks)
         the game mechanics forward by one second; when the game is determined
         to be over, a "GAME OVER" message is displayed and the program ends
+
+        The game mechanics advance on a fixed timestep that is independent of
+        the frame rate, frames are capped at the render FPS (0 for no cap), and
+        while nothing changes on screen the loop sleeps until the next event
+        or tick is due; when the fall speed changes, the time built up at the
+        old speed is capped at one tick, so pressing down does not make the
+        Faller jump several rows at once; with a spectator port, every tick is
+        streamed to spectators from a background thread
         '''
         pygame.init()
         clock = pygame.time.Clock()
 
         try:
+            if self._spectate_address is not None:
+                self._spectators = SpectatorThread(*self._spectate_address)
+                self._publish()
             self._create_surface((_INIT_WIDTH, _INIT_HEIGHT))
+            accumulator = 0
+            previous_time = pygame.time.get_ticks()
+            tick_length = self._tick_length()
 
             while self._running:
-                clock.tick()
+                frame_start = time.perf_counter()
                 self._handle_events()
-                self._redraw()
 
-                if self._check_game_over():
+                current_time = pygame.time.get_ticks()
+                accumulator += current_time - previous_time
+                previous_time = current_time
+                if self._tick_length() != tick_length:
+                    tick_length = self._tick_length()
+                    accumulator = min(accumulator, tick_length)
+
+                if not self._advance(accumulator // tick_length):
                     self._end_game()
                     break
+                accumulator %= tick_length
 
-                self._create_faller()
+                changed = self._redraw()
+                if self._profiler is not None:
+                    self._profiler.record("frame", time.perf_counter() - frame_start)
+                    if self._profiler.poll():
+                        self._overlay.invalidate()
 
-                self._fall_time += clock.get_rawtime()
-                if self._fall_time / 1000 > self._fall_speed:
-                    self._fall_time = 0
-                    self._tick()
+                if not self._running:
+                    break
+                if not changed:
+                    self._wait(tick_length - accumulator)
+                clock.tick(self._render_fps)
         finally:
+            if self._spectators is not None:
+                self._spectators.close()
+            if self._profiler is not None:
+                self._profiler.close()
+            if self._autoplayer is not None:
+                self._autoplayer.close()
+            if self._recorder is not None:
+                self._recorder.save(self._record_path, self._simulation.ticks(), self._game_state)
             pygame.quit()
 
+    def input_latency(self) -> dict[str, float]:
+        '''Returns the input-to-display latency measured so far (see LatencyMeter.stats)'''
+        return self._latency.stats()
+
+    def profile_stats(self) -> dict or None:
+        '''Returns the timings and counters recorded so far (see Profiler.stats), or None if not profiling'''
+        return self._profiler.stats() if self._profiler is not None else None
+
+    def _start_profiling(self, dump_path: str = None) -> None:
+        '''
+        Instruments the game mechanics (with counters of the Jewels matched and
+        moved), the simulation tick (with its memory allocations and garbage
+        collections) and the event handling and redrawing of the game loop
+        '''
+        self._profiler = Profiler(dump_path)
+        instrument_engine(self._profiler, self._game_state)
+        self._profiler.instrument(self._simulation, "tick", allocations=True)
+        self._profiler.instrument(self, "_redraw")
+        self._profiler.instrument(self, "_handle_events")
+        self._overlay = PerformanceOverlay(self._profiler, _OVERLAY_FONT_SIZE, _BOARD_OUTLINE_COLOR, _BACKGROUND_COLOR)
+
+    def _toggle_overlay(self) -> None:
+        '''Shows or hides the performance overlay, starting to profile the first time it is shown'''
+        if self._profiler is None:
+            self._start_profiling()
+        self._overlay.toggle()
+        if not self._overlay.visible():
+            self._renderer.invalidate()
+
+    def _tick_length(self) -> int:
+        '''Returns the length of a game tick in milliseconds at the current fall speed'''
+        return int(self._fall_speed * 1000)
+
+    def _advance(self, ticks: int) -> bool:
+        '''
+        Creates a Faller if needed and advances the game mechanics by the given
+        number of ticks (at most _MAX_TICKS_PER_FRAME, so that a stalled frame
+        does not make the game race to catch up); returns False once the game is over
+        '''
+        if self._simulation.check_game_over():
+            return False
+        self._create_faller()
+
+        for _ in range(min(ticks, _MAX_TICKS_PER_FRAME)):
+            self._simulation.tick()
+            if self._recorder is not None:
+                self._recorder.record_tick(self._simulation.ticks(), self._game_state)
+            self._publish()
+
+            if self._simulation.check_game_over():
+                return False
+            self._create_faller()
+
+        return True
+
+    def _publish(self) -> None:
+        '''Streams the board to the spectators, if there is a spectator server'''
+        if self._spectators is not None:
+            self._spectators.publish(self._game_state.snapshot(), self._simulation.ticks())
+
+    def _create_faller(self) -> None:
+        '''
+        Creates a Faller if needed; in demo mode, the autoplayer then picks where
+        to place a new Faller and its moves are applied right away
+        '''
+        faller = self._game_state.faller()
+        self._simulation.create_faller()
+
+        new_faller = self._game_state.faller()
+        if self._autoplayer is not None and new_faller is not None and new_faller is not faller:
+            for action in self._autoplayer.choose(self._game_state).actions:
+                self._apply_action(action)
+
+    def _wait(self, timeout: int) -> None:
+        '''Sleeps until an event arrives or the given number of milliseconds has passed'''
+        event = pygame.event.wait(max(1, timeout))
+        if event.type != pygame.NOEVENT:
+            self._handle_event(event)
+
     def _create_surface(self, size: tuple[int]) -> None:
         '''Creates a resizeable screen for the game with the initial width and height'''
         self._surface = pygame.display.set_mode(size, pygame.RESIZABLE)
@@ -66,80 +236,84 @@ class Columns():
     def _handle_events(self) -> None:
         '''Handles various events like quitting, resizing, and key presses'''
         for event in pygame.event.get():
-            if event.type == pygame.QUIT:
-                self._running = False
-            elif event.type == pygame.VIDEORESIZE:
-                self._create_surface(event.size)
-
-            self._handle_keys(event)
+            self._handle_event(event)
+
+    def _handle_event(self, event: pygame.event.Event) -> None:
+        '''Handles a single event'''
+        if event.type == pygame.QUIT:
+            self._running = False
+        elif event.type == pygame.VIDEORESIZE:
+            self._create_surface(event.size)
+            self._renderer.invalidate()
+        elif event.type == pygame.VIDEOEXPOSE:
+            self._renderer.invalidate()
+        elif event.type == pygame.KEYDOWN and event.key == pygame.K_F3:
+            self._toggle_overlay()
+
+        self._handle_keys(event)
 
     def _handle_keys(self, event: pygame.event.Event) -> None:
         '''
         Handles specific key presses: left key moves the faller left,
         right key moves the faller right, space bar rotates the faller,
-        and down key increases the faller's fall speed
+        and down key increases the faller's fall speed; in demo mode, the
+        autoplayer plays and key presses are ignored
         '''
+        if self._autoplayer is not None:
+            return
+
         if event.type == pygame.KEYDOWN:
-            if self._game_state.faller() != None:
-                if event.key == pygame.K_LEFT:
-                    self._game_state.faller().move_left()
-                    self._game_state.faller().check_if_landed()
-                    self._game_state.faller().check_if_unlanded()
-                elif event.key == pygame.K_RIGHT:
-                    self._game_state.faller().move_right()
-                    self._game_state.faller().check_if_landed()
-                    self._game_state.faller().check_if_unlanded()
-                elif event.key == pygame.K_SPACE:
-                    self._game_state.faller().rotate()
-
-                if event.key == pygame.K_DOWN:
-                    self._fall_speed = 0.1
+            self._latency.input_received()
+
+            if event.key == pygame.K_LEFT:
+                self._apply_action("left")
+            elif event.key == pygame.K_RIGHT:
+                self._apply_action("right")
+            elif event.key == pygame.K_SPACE:
+                self._apply_action("rotate")
+
+            if event.key == pygame.K_DOWN and self._apply_action("down"):
+                self._fall_speed = 0.1
         if event.type == pygame.KEYUP:
             if event.key == pygame.K_DOWN:
                 self._fall_speed = 1
 
-    def _redraw(self) -> None:
-        '''Displays the screen with the background color and board'''
-        surface = pygame.display.get_surface()
-        surface.fill(_BACKGROUND_COLOR)
-        self._draw_board()
-        pygame.display.flip()
+    def _apply_action(self, action: str) -> bool:
+        '''Applies a player action to the Faller and records it if it was applied'''
+        applied = self._simulation.apply_action(action)
+        if applied and self._recorder is not None:
+            self._recorder.record_input(self._simulation.ticks(), action)
+        return applied
 
-    def _draw_board(self) -> None:
+    def _redraw(self) -> bool:
         '''
-        Draws the game board (according to the field in the game mechanics)
-        as a grid of cells that are either empty or have Jewels in them
+        Displays the board, pushing only the cells that changed since the last
+        frame to the screen (or the whole screen after a resize); returns
+        False if nothing changed
         '''
-        start_y = self._frac_y_to_pixel(7 / _INIT_HEIGHT)
-
-        for row in self._game_state.field()[2:]:
-            start_x = self._frac_x_to_pixel(165 / _INIT_WIDTH)
-
-            for jewel in row:
-                rect = pygame.Rect(start_x, start_y, self._frac_x_to_pixel(_BOARD_CELL_SIZE), self._frac_y_to_pixel(_BOARD_CELL_SIZE))
-                pygame.draw.rect(self._surface, _BOARD_OUTLINE_COLOR, rect, 1)
-                self._draw_jewel(jewel, rect)
-
-                start_x += self._frac_x_to_pixel(_BOARD_CELL_SIZE)
-            start_y += self._frac_y_to_pixel(_BOARD_CELL_SIZE)
-
-    def _draw_jewel(self, jewel: Jewel, rect: pygame.Rect) -> None:
+        changed = self._draw_board()
+        if self._overlay is not None:
+            if changed is None:
+                self._overlay.invalidate()
+            overlay_rect = self._overlay.draw(self._surface)
+            if overlay_rect is not None and changed is not None:
+                changed.append(overlay_rect)
+
+        if changed is None:
+            pygame.display.flip()
+        elif changed:
+            pygame.display.update(changed)
+        self._latency.frame_displayed()
+
+        return changed is None or len(changed) > 0
+
+    def _draw_board(self) -> list[pygame.Rect] or None:
         '''
-        If there is a Jewel in the field from the game mechanics,
-        a Jewel (colored circle) is drawn, along with additional features
-        depending on its state (LANDING, MATCHING)
+        Draws the game board (according to the field in the game mechanics)
+        as a grid of cells that are either empty or have Jewels in them;
+        returns the rects that changed, or None if the whole surface was redrawn
         '''
-        if jewel.color() != " ":
-            color = self._get_color(jewel.color())
-
-            if jewel.state() == "LANDED":
-                pygame.draw.ellipse(self._surface, color, rect.inflate(-10, -10))
-                pygame.draw.rect(self._surface, _BOARD_OUTLINE_COLOR, rect.inflate(-8, -8), 1)
-            elif jewel.state() == "MATCHED":
-                pygame.draw.rect(self._surface, _BOARD_OUTLINE_COLOR, rect)
-                pygame.draw.ellipse(self._surface, color, rect.inflate(-10, -10))
-            else:
-                pygame.draw.ellipse(self._surface, color, rect.inflate(-10, -10))
+        return self._renderer.draw(self._surface, self._game_state.field())
 
     def _get_color(self, color: str) -> pygame.Color:
         '''
@@ -161,62 +335,6 @@ class Columns():
         elif color == "Z":
             return _PINK
             
-    def _create_faller(self) -> None:
-        '''Creates a faller in the game mechanics'''
-        if self._game_state.faller() == None and not self._game_state.check_match():
-            random_column = self._random_column()
-            random_colors = self._random_colors(_JEWEL_COLORS)
-            self._game_state.place_faller(Faller(self._game_state,
-                                                random_column,
-                                                Jewel(random_colors[0]),
-                                                Jewel(random_colors[1]),
-                                                Jewel(random_colors[2])))
-
-    def _random_column(self) -> int:
-        '''
-        Returns a random column number if that column is not full;
-        if it is full, it runs again until it gets a valid column number
-        '''
-        while True:
-            random_column = random.randint(1, 6)
-            if self._game_state.field()[2][random_column - 1].color() == " ":
-                break
-
-        return random_column
-
-    def _random_colors(self, colors: list[str]) -> list[str]:
-        '''Returns a list of three random colors (strings) from a list of colors'''
-        random_colors = []
-        for _ in range(3):
-            random_colors.append(random.choice(colors))
-
-        return random_colors
-
-    def _tick(self) -> None:
-        '''
-        Advances the game by one tick (one second) and updates
-        the state of the game/field accordingly
-        '''
-        if self._game_state.faller() == None:
-            self._game_state.remove_matches()
-            self._game_state.normal_gravity()
-            self._game_state.match()
-        else:
-            self._game_state.tick_gravity()
-            if self._game_state.faller().state() == "FALLING":
-                self._game_state.faller().check_if_landed()
-            elif self._game_state.faller().state() == "LANDED":
-                self._game_state.faller().check_if_unlanded()
-                self._game_state.faller().frozen()
-                self._game_state.match()
-
-    def _check_game_over(self) -> bool:
-        '''Checks if the game is over (if the GameState object's_game_over attribute is True)'''
-        if self._game_state.faller() == None:
-            self._game_state.check_game_over()
-            if self._game_state.game_over():
-                return True
-
     def _end_game(self) -> None:
         '''Displays "GAME OVER" on the screen when the game ends'''
         text_font = pygame.font.SysFont("Monospace", self._scale_font(100 / 600), True)
@@ -229,18 +347,29 @@ class Columns():
         pygame.display.update()
         pygame.time.delay(2000)
 
-    def _frac_x_to_pixel(self, frac_x: float) -> int:
-        '''Converts the given fractional x-coordinate to a pixel x-coordinate'''
-        return int(frac_x * self._surface.get_width())
-
-    def _frac_y_to_pixel(self, frac_y: float) -> int:
-        '''Converts the given fractional y-coordinate to a pixel y-coordinate'''
-        return int(frac_y * self._surface.get_height())
-
     def _scale_font(self, font_scale: int) -> int:
         '''Scales the font size according to the size (width) of the screen'''
         return int(font_scale * self._surface.get_width())
 
 
 if __name__ == "__main__":
-    Columns().run()
\ No newline at end of file
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Columns")
+    parser.add_argument("--fps", type=int, default=_RENDER_FPS, help="render frame rate cap (0 for no cap)")
+    parser.add_argument("--show-latency", action="store_true", help="print input-to-display latency on exit")
+    parser.add_argument("--record", metavar="PATH", help="record the game to a replay file")
+    parser.add_argument("--demo", action="store_true", help="let the autoplayer play (attract mode)")
+    parser.add_argument("--profile", metavar="PATH",
+                        help="profile the game and append the stats to a JSON lines file every second (F3 shows them)")
+    parser.add_argument("--spectate", metavar="PORT", type=int,
+                        help="stream the game to spectators (python spectator.py watch --port PORT)")
+    parser.add_argument("--spectate-host", default=_SPECTATE_HOST, help="address to accept spectators on")
+    args = parser.parse_args()
+
+    game = Columns(render_fps=args.fps, record_path=args.record, demo=args.demo, profile_path=args.profile,
+                   spectate_port=args.spectate, spectate_host=args.spectate_host)
+    game.run()
+
+    if args.show_latency:
+        print(game.input_latency())
\ No newline at end of file
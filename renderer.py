@@ -0,0 +1,174 @@
+from game_mechanics import Jewel, State
+from instrumentation import Profiler
+from typing import Callable
+import pygame
+
+
+_OVERLAY_LINES = 5
+
+
+class BoardRenderer():
+    '''
+    Draws the visible field as a grid of cells, blitting pre-rendered cell
+    sprites and redrawing only the cells whose contents changed since the
+    previous frame
+
+    Sprites are cached by (color, state, cell size); both the sprite cache and
+    the cell layout are rebuilt when the surface is resized
+    '''
+    def __init__(self, origin: tuple[float, float], cell_size: float,
+                 background_color: pygame.Color, outline_color: pygame.Color,
+                 get_color: Callable[[str], pygame.Color]) -> None:
+        self._origin = origin
+        self._cell_size = cell_size
+        self._background_color = background_color
+        self._outline_color = outline_color
+        self._get_color = get_color
+        self._sprites = {}
+        self._drawn = {}
+        self._rects = None
+        self._surface_size = None
+
+    def invalidate(self) -> None:
+        '''Forces the next frame to redraw the whole surface (e.g. after it was resized or exposed)'''
+        self._drawn = {}
+        self._rects = None
+
+    def draw(self, surface: pygame.Surface, field: list[list[Jewel]]) -> list[pygame.Rect] or None:
+        '''
+        Draws the cells of the visible field that changed since the last frame and
+        returns their rects, or None if the whole surface was redrawn
+        '''
+        if surface.get_size() != self._surface_size:
+            self._surface_size = surface.get_size()
+            self._sprites = {}
+            self.invalidate()
+
+        full_redraw = self._rects is None
+        if full_redraw:
+            surface.fill(self._background_color)
+            self._rects = self._layout(surface, len(field) - 2, len(field[0]) if len(field) > 0 else 0)
+
+        changed = []
+        for r, row in enumerate(field[2:]):
+            for c, jewel in enumerate(row):
+                key = self._sprite_key(jewel)
+                if self._drawn.get((r, c)) != key:
+                    rect = self._rects[r][c]
+                    surface.blit(self._sprite(key, rect.size), rect)
+                    self._drawn[(r, c)] = key
+                    changed.append(rect)
+
+        return None if full_redraw else changed
+
+    def _layout(self, surface: pygame.Surface, rows: int, columns: int) -> list[list[pygame.Rect]]:
+        '''Returns the rect of every visible cell for the current surface size'''
+        width, height = surface.get_size()
+        cell_width = int(self._cell_size * width)
+        cell_height = int(self._cell_size * height)
+        start_x = int(self._origin[0] * width)
+        start_y = int(self._origin[1] * height)
+
+        return [[pygame.Rect(start_x + c * cell_width, start_y + r * cell_height, cell_width, cell_height)
+                 for c in range(columns)]
+                for r in range(rows)]
+
+    def _sprite_key(self, jewel: Jewel) -> tuple[str, State]:
+        '''Returns the (color, state) pair that determines how a cell looks'''
+        if jewel.code() == 0:
+            return (" ", State.FROZEN)
+        return (jewel.color(), jewel.state())
+
+    def _sprite(self, key: tuple[str, State], size: tuple[int, int]) -> pygame.Surface:
+        '''Returns the cached sprite for a cell with the given contents and size, rendering it if needed'''
+        sprite = self._sprites.get((key, size))
+        if sprite is None:
+            sprite = self._render_cell(key, size)
+            self._sprites[(key, size)] = sprite
+        return sprite
+
+    def _render_cell(self, key: tuple[str, State], size: tuple[int, int]) -> pygame.Surface:
+        '''
+        Renders a cell: its outline and, if there is a Jewel in it, a colored
+        circle with additional features depending on its state (LANDED, MATCHED)
+        '''
+        color, state = key
+        sprite = pygame.Surface(size)
+        sprite.fill(self._background_color)
+        rect = sprite.get_rect()
+        pygame.draw.rect(sprite, self._outline_color, rect, 1)
+
+        if color != " ":
+            jewel_color = self._get_color(color)
+
+            if state == State.LANDED:
+                pygame.draw.ellipse(sprite, jewel_color, rect.inflate(-10, -10))
+                pygame.draw.rect(sprite, self._outline_color, rect.inflate(-8, -8), 1)
+            elif state == State.MATCHED:
+                pygame.draw.rect(sprite, self._outline_color, rect)
+                pygame.draw.ellipse(sprite, jewel_color, rect.inflate(-10, -10))
+            else:
+                pygame.draw.ellipse(sprite, jewel_color, rect.inflate(-10, -10))
+
+        return sprite.convert() if pygame.display.get_surface() is not None else sprite
+
+
+class PerformanceOverlay():
+    '''
+    Draws the frame rate, frame time and the mean time of the costliest
+    instrumented calls of the profiler's last completed window in the top left
+    corner of the surface, left of the board
+
+    The text is only re-rendered when a new window completes (or after a full
+    redraw), so showing the overlay does not add work to every frame
+    '''
+    def __init__(self, profiler: Profiler, font_scale: float,
+                 text_color: pygame.Color, background_color: pygame.Color) -> None:
+        self._profiler = profiler
+        self._font_scale = font_scale
+        self._text_color = text_color
+        self._background_color = background_color
+        self._visible = False
+        self._stale = True
+        self._rect = None
+
+    def visible(self) -> bool:
+        '''Returns True if the overlay is shown'''
+        return self._visible
+
+    def toggle(self) -> None:
+        '''Shows the overlay if it is hidden and hides it if it is shown'''
+        self._visible = not self._visible
+        self._stale = True
+
+    def invalidate(self) -> None:
+        '''Forces the overlay to be drawn again on the next frame'''
+        self._stale = True
+
+    def draw(self, surface: pygame.Surface) -> pygame.Rect or None:
+        '''Draws the overlay if it is shown and out of date; returns the rect it covers, or None'''
+        if not self._visible or not self._stale:
+            return None
+        self._stale = False
+
+        window = self._profiler.window_stats()
+        frame = window["timings"].get("frame", {"count": 0, "mean_ms": 0.0, "max_ms": 0.0})
+        fps = frame["count"] / window["seconds"] if window["seconds"] > 0 else 0.0
+        lines = [f"FPS {fps:6.1f}", f"frame {frame['mean_ms']:5.1f}ms", f"max   {frame['max_ms']:5.1f}ms"]
+        for label, stats in self._profiler.top(_OVERLAY_LINES, exclude=("frame",)):
+            lines.append(f"{label.strip('_')[:8]:<8}{stats['mean_ms']:5.1f}ms")
+
+        font = pygame.font.SysFont("Monospace", max(8, int(self._font_scale * surface.get_width())))
+        texts = [font.render(line, True, self._text_color) for line in lines]
+        rect = pygame.Rect(0, 0, max(text.get_width() for text in texts) + 8,
+                           sum(text.get_height() for text in texts) + 8)
+
+        covered = rect if self._rect is None else rect.union(self._rect)
+        surface.fill(self._background_color, covered)
+        y = 4
+        for text in texts:
+            surface.blit(text, (4, y))
+            y += text.get_height()
+
+        self._rect = rect
+        return covered
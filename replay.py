@@ -0,0 +1,160 @@
+from game_mechanics import GameState
+from simulation import Simulation
+import struct
+import zlib
+
+
+_MAGIC = b"CLRP"
+_VERSION = 2
+_HEADER = struct.Struct("<4sBQHHH")
+_CHECKSUM = struct.Struct("<I")
+_ACTIONS = ["left", "right", "rotate", "down"]
+_ACTION_CODES = {action: code for code, action in enumerate(_ACTIONS)}
+_CHECKPOINT = 0x10
+_END = 0x11
+_CHECKPOINT_INTERVAL = 60
+
+
+class ReplayError(Exception):
+    pass
+
+
+def board_checksum(game_state: GameState) -> int:
+    '''Returns a CRC-32 of the color codes and states of every cell in the field'''
+    return zlib.crc32(bytes(value for row in game_state.field() for jewel in row
+                            for value in (jewel.code(), jewel.state())))
+
+
+class Recorder():
+    '''
+    Records a game as its RNG seed plus the tick index of every input that was
+    applied, with a board checksum every checkpoint_interval ticks
+
+    Each record is one kind byte followed by the number of ticks since the
+    previous record as a varint, so an input usually takes two bytes
+    '''
+    def __init__(self, seed: int, rows: int, columns: int, checkpoint_interval: int = _CHECKPOINT_INTERVAL) -> None:
+        self._buffer = bytearray(_HEADER.pack(_MAGIC, _VERSION, seed, rows, columns, checkpoint_interval))
+        self._checkpoint_interval = checkpoint_interval
+        self._last_tick = 0
+
+    def record_input(self, tick: int, action: str) -> None:
+        '''Records an input that was applied before the tick with the given index'''
+        self._record(_ACTION_CODES[action], tick)
+
+    def record_tick(self, tick: int, game_state: GameState) -> None:
+        '''Records a board checksum if the given tick (just completed) is a checkpoint'''
+        if tick % self._checkpoint_interval == 0:
+            self._record(_CHECKPOINT, tick)
+            self._buffer += _CHECKSUM.pack(board_checksum(game_state))
+
+    def finish(self, tick: int, game_state: GameState) -> bytes:
+        '''Records the end of the game with a final board checksum and returns the recording'''
+        self._record(_END, tick)
+        self._buffer += _CHECKSUM.pack(board_checksum(game_state))
+        return bytes(self._buffer)
+
+    def save(self, path: str, tick: int, game_state: GameState) -> None:
+        '''Records the end of the game and writes the recording to a file'''
+        with open(path, "wb") as file:
+            file.write(self.finish(tick, game_state))
+
+    def _record(self, kind: int, tick: int) -> None:
+        '''Appends a record of the given kind at the given tick'''
+        delta = tick - self._last_tick
+        self._last_tick = tick
+
+        self._buffer.append(kind)
+        while delta >= 0x80:
+            self._buffer.append(delta & 0x7F | 0x80)
+            delta >>= 7
+        self._buffer.append(delta)
+
+
+def read_header(data: bytes) -> tuple[int, int, int, int]:
+    '''Returns the (seed, rows, columns, checkpoint interval) of a recording'''
+    if len(data) < _HEADER.size:
+        raise ReplayError("recording is too short")
+
+    magic, version, seed, rows, columns, checkpoint_interval = _HEADER.unpack_from(data)
+    if magic != _MAGIC or version != _VERSION:
+        raise ReplayError("not a Columns replay (or an unsupported version)")
+    return seed, rows, columns, checkpoint_interval
+
+
+def play(data: bytes, colors: list[str] = None) -> Simulation:
+    '''
+    Replays a recording through a headless Simulation as fast as possible,
+    verifying the board checksum at every checkpoint; returns the Simulation
+    at the end of the game
+
+    Columns creates the next Faller right after each tick, so the game is
+    ended the same way (if it is not over) before the final checksum
+
+    Raises ReplayError if a checksum does not match or the recording is malformed
+    '''
+    seed, rows, columns, _ = read_header(data)
+    simulation = Simulation(seed, rows, columns) if colors is None else Simulation(seed, rows, columns, colors)
+    offset = _HEADER.size
+    tick = 0
+
+    while offset < len(data):
+        kind = data[offset]
+        offset += 1
+
+        delta = shift = 0
+        while True:
+            if offset >= len(data):
+                raise ReplayError("recording ends in the middle of a record")
+            byte = data[offset]
+            offset += 1
+            delta |= (byte & 0x7F) << shift
+            shift += 7
+            if byte < 0x80:
+                break
+        tick += delta
+
+        _advance_to(simulation, tick)
+
+        if kind < len(_ACTIONS):
+            simulation.check_game_over()
+            simulation.create_faller()
+            simulation.apply_action(_ACTIONS[kind])
+        elif kind == _CHECKPOINT or kind == _END:
+            if kind == _END and not simulation.check_game_over():
+                simulation.create_faller()
+            (expected,) = _CHECKSUM.unpack_from(data, offset)
+            offset += _CHECKSUM.size
+            actual = board_checksum(simulation.game_state())
+            if actual != expected:
+                raise ReplayError(f"board checksum mismatch at tick {tick}: expected {expected:08x}, got {actual:08x}")
+            if kind == _END:
+                return simulation
+        else:
+            raise ReplayError(f"unknown record kind {kind:#x}")
+
+    raise ReplayError("recording has no end record")
+
+
+def play_file(path: str, colors: list[str] = None) -> Simulation:
+    '''Replays the recording in the given file (see play)'''
+    with open(path, "rb") as file:
+        return play(file.read(), colors)
+
+
+def _advance_to(simulation: Simulation, tick: int) -> None:
+    '''Steps the simulation with no inputs until it has completed the given number of ticks'''
+    while simulation.ticks() < tick:
+        if not simulation.step() and simulation.ticks() < tick:
+            raise ReplayError(f"game ended at tick {simulation.ticks()} before reaching tick {tick}")
+
+
+if __name__ == "__main__":
+    import sys
+    import time
+
+    start = time.perf_counter()
+    simulation = play_file(sys.argv[1])
+    elapsed = time.perf_counter() - start
+    print(f"replayed {simulation.ticks()} ticks in {elapsed * 1000:.1f} ms; all checkpoints matched")
+    print(simulation.stats())
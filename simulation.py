@@ -0,0 +1,255 @@
+from game_mechanics import CascadeCache, Jewel, Faller, GameState, State, create_empty_field
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from typing import Callable, Iterable, NamedTuple
+import random
+
+
+ROW_COUNT = 13
+COLUMN_COUNT = 6
+JEWEL_COLORS = ["R", "O", "Y", "G", "B", "P", "Z"]
+_ACTIONS = ["left", "right", "rotate", "down"]
+
+
+class GameStats(NamedTuple):
+    seed: int or None
+    ticks: int
+    jewels_cleared: int
+    chains: int
+    max_chain: int
+
+
+class Simulation():
+    '''
+    Runs the game flow (creating Fallers, applying player actions and ticking
+    the game mechanics) without any display or wall-clock timing
+
+    All randomness comes from a random.Random seeded with the given seed,
+    so the same seed and inputs always play out the same game
+
+    With instant_cascades, the whole cascade after a Faller freezes is resolved
+    in that tick (through the cascade cache, if one is given) instead of one
+    step per tick; the score is the same, but the game's timing is not, so
+    recordings must be played back the way they were recorded
+    '''
+    def __init__(self, seed: int = None, rows: int = ROW_COUNT, columns: int = COLUMN_COUNT,
+                 colors: list[str] = JEWEL_COLORS, game_state: GameState = None,
+                 instant_cascades: bool = False, cascade_cache: CascadeCache = None) -> None:
+        self._seed = seed
+        self._random = random.Random(seed)
+        self._colors = colors
+        self._instant_cascades = instant_cascades
+        self._cascade_cache = cascade_cache
+        if game_state is None:
+            game_state = GameState(rows, columns, create_empty_field(rows, columns))
+        self._game_state = game_state
+        self._ticks = 0
+        self._jewels_cleared = 0
+        self._chains = 0
+        self._max_chain = 0
+        self._chain = 0
+
+    def game_state(self) -> GameState:
+        '''Returns the GameState that the simulation advances'''
+        return self._game_state
+
+    def ticks(self) -> int:
+        '''Returns the number of ticks the simulation has advanced'''
+        return self._ticks
+
+    def stats(self) -> GameStats:
+        '''Returns the statistics of the game so far'''
+        return GameStats(self._seed, self._ticks, self._jewels_cleared, self._chains, self._max_chain)
+
+    def apply_action(self, action: str) -> bool:
+        '''
+        Applies a player action to the Faller, if there is one: "left" and "right"
+        move it, "rotate" rotates it; "down" only speeds up real-time play
+        and does not change the game mechanics
+
+        Returns False if there was no Faller for the action to apply to
+        '''
+        faller = self._game_state.faller()
+        if faller == None:
+            return False
+
+        if action == "left":
+            faller.move_left()
+            faller.check_if_landed()
+            faller.check_if_unlanded()
+        elif action == "right":
+            faller.move_right()
+            faller.check_if_landed()
+            faller.check_if_unlanded()
+        elif action == "rotate":
+            faller.rotate()
+        elif action != "down":
+            raise ValueError(f"unknown action: {action!r}")
+
+        return True
+
+    def check_game_over(self) -> bool:
+        '''Checks if the game is over; the game can only end while there is no Faller'''
+        if self._game_state.faller() == None:
+            self._game_state.check_game_over()
+        return self._game_state.game_over()
+
+    def create_faller(self) -> None:
+        '''
+        Creates a Faller in a random column that is not full, given that there is
+        no Faller and no matched Jewels; if every column is full, the game is over
+        '''
+        if self._game_state.faller() == None and not self._game_state.check_match():
+            random_column = self._random_column()
+            if random_column is None:
+                self._game_state.end_game()
+                return
+
+            random_colors = self._random_colors()
+            self._game_state.place_faller(Faller(self._game_state,
+                                                 random_column,
+                                                 Jewel(random_colors[0]),
+                                                 Jewel(random_colors[1]),
+                                                 Jewel(random_colors[2])))
+            self._chain = 0
+
+    def tick(self) -> None:
+        '''Advances the game by one tick and updates the state of the game/field accordingly'''
+        self._ticks += 1
+
+        if self._game_state.faller() == None:
+            self._game_state.remove_matches()
+            self._game_state.normal_gravity()
+            self._count_matches(self._game_state.match(incremental=True))
+        else:
+            self._game_state.tick_gravity()
+            if self._game_state.faller().state() == State.FALLING:
+                self._game_state.faller().check_if_landed()
+            elif self._game_state.faller().state() == State.LANDED:
+                self._game_state.faller().check_if_unlanded()
+                self._game_state.faller().frozen()
+                if self._instant_cascades and self._game_state.faller() == None:
+                    for step in self._game_state.resolve_cascade(self._cascade_cache).steps:
+                        self._count_matches(step.cleared)
+                else:
+                    self._count_matches(self._game_state.match(incremental=True))
+
+    def step(self, actions: Iterable[str] = ()) -> bool:
+        '''
+        Advances the game by one logical tick: creates a Faller if needed,
+        applies the given actions and ticks; returns False once the game is over
+        '''
+        if self.check_game_over():
+            return False
+
+        self.create_faller()
+        for action in actions:
+            self.apply_action(action)
+        self.tick()
+        return not self._game_state.game_over()
+
+    def run(self, max_ticks: int, inputs: Iterable[tuple[int, str]] = ()) -> GameStats:
+        '''
+        Plays the game until it is over or max_ticks ticks have passed, applying
+        each (tick, action) input right before the tick with that index; returns
+        the statistics of the game
+        '''
+        pending = {}
+        for tick, action in inputs:
+            pending.setdefault(tick, []).append(action)
+
+        while self._ticks < max_ticks:
+            if not self.step(pending.pop(self._ticks, ())):
+                break
+
+        return self.stats()
+
+    def _count_matches(self, matched: set[tuple[int, int]] or tuple[tuple[int, int], ...]) -> None:
+        '''Counts the Jewels that were just matched towards the current chain'''
+        if matched:
+            self._jewels_cleared += len(matched)
+            self._chain += 1
+            if self._chain == 1:
+                self._chains += 1
+            self._max_chain = max(self._max_chain, self._chain)
+
+    def _random_column(self) -> int or None:
+        '''
+        Returns a random (1-based) column number of a column that is not full, or None if all are full
+
+        The game state keeps the free columns indexed, so this does not scan the
+        field; the column is drawn exactly as random.choice would draw it from the
+        free columns in order, so seeded games and recordings play out as before
+        '''
+        count = self._game_state.free_column_count()
+        if count == 0:
+            return None
+        return self._game_state.free_column(self._random.randrange(count)) + 1
+
+    def _random_colors(self) -> list[str]:
+        '''Returns a list of three random colors (strings) from the simulation's colors'''
+        return [self._random.choice(self._colors) for _ in range(3)]
+
+
+def random_inputs(seed: int, max_ticks: int, press_chance: float = 0.5) -> list[tuple[int, str]]:
+    '''
+    Returns a reproducible stream of (tick, action) inputs for a game: before
+    every tick, a random action is pressed with the given chance
+    '''
+    rng = random.Random(seed)
+    return [(tick, rng.choice(_ACTIONS[:3])) for tick in range(max_ticks) if rng.random() < press_chance]
+
+
+def play_game(seed: int, max_ticks: int, rows: int = ROW_COUNT, columns: int = COLUMN_COUNT,
+              colors: list[str] = JEWEL_COLORS,
+              input_script: Callable[[int, int], Iterable[tuple[int, str]]] = None,
+              instant_cascades: bool = False) -> GameStats:
+    '''
+    Plays one headless game with the given seed and returns its statistics;
+    input_script(seed, max_ticks) supplies the player's inputs, if given
+    '''
+    inputs = input_script(seed, max_ticks) if input_script is not None else ()
+    simulation = Simulation(seed, rows, columns, colors, instant_cascades=instant_cascades)
+    return simulation.run(max_ticks, inputs)
+
+
+def run_batch(seeds: Iterable[int], max_ticks: int, rows: int = ROW_COUNT, columns: int = COLUMN_COUNT,
+              colors: list[str] = JEWEL_COLORS,
+              input_script: Callable[[int, int], Iterable[tuple[int, str]]] = random_inputs,
+              workers: int = None, chunksize: int = 64, instant_cascades: bool = False) -> list[GameStats]:
+    '''
+    Plays one game per seed across a pool of worker processes and returns the
+    statistics of every game, in the order of the seeds
+
+    input_script must be a module-level function so that it can be sent to the workers
+    '''
+    game = partial(play_game, max_ticks=max_ticks, rows=rows, columns=columns,
+                   colors=colors, input_script=input_script, instant_cascades=instant_cascades)
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(game, seeds, chunksize=chunksize))
+
+
+if __name__ == "__main__":
+    import argparse
+    import statistics
+
+    parser = argparse.ArgumentParser(description="Plays seeded headless Columns games across a process pool")
+    parser.add_argument("--games", type=int, default=1000)
+    parser.add_argument("--first-seed", type=int, default=0)
+    parser.add_argument("--max-ticks", type=int, default=10000)
+    parser.add_argument("--rows", type=int, default=ROW_COUNT)
+    parser.add_argument("--columns", type=int, default=COLUMN_COUNT)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--instant-cascades", action="store_true",
+                        help="resolve each cascade in the tick its Faller freezes")
+    args = parser.parse_args()
+
+    results = run_batch(range(args.first_seed, args.first_seed + args.games), args.max_ticks,
+                        args.rows, args.columns, workers=args.workers, instant_cascades=args.instant_cascades)
+
+    print(f"games:               {len(results)}")
+    print(f"mean ticks survived: {statistics.mean(r.ticks for r in results):.1f}")
+    print(f"mean jewels cleared: {statistics.mean(r.jewels_cleared for r in results):.1f}")
+    print(f"mean chains:         {statistics.mean(r.chains for r in results):.1f}")
+    print(f"longest chain:       {max(r.max_chain for r in results)}")
@@ -0,0 +1,194 @@
+from game_mechanics import FallerSnapshot, Snapshot, State, color_code, known_colors
+from typing import Iterable, Iterator
+import mmap
+import struct
+
+
+_MAGIC = b"CLSS"
+_VERSION = 1
+_FILE_HEADER = struct.Struct("<4sBHHIB")
+_RECORD_HEADER = struct.Struct("<BBhHB3B3B3h")
+_FALLER_CODES_OFFSET = struct.calcsize("<BBhHB")
+
+
+class SnapshotFileError(Exception):
+    pass
+
+
+def snapshot_to_bytes(snapshot: Snapshot) -> bytes:
+    '''
+    Returns a snapshot as one fixed-size record: the game over flag, the Faller
+    (if any) and then the cells; every snapshot of the same board size
+    has the same record size
+    '''
+    faller = snapshot.faller
+    if faller is None:
+        header = _RECORD_HEADER.pack(snapshot.game_over, False, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0)
+    else:
+        header = _RECORD_HEADER.pack(snapshot.game_over, True, faller.row, faller.col, faller.state,
+                                     *faller.codes, *faller.states, *faller.cell_rows)
+    return header + snapshot.cells
+
+
+def snapshot_from_bytes(record: bytes, rows: int, columns: int) -> Snapshot:
+    '''Returns the snapshot of a game of the given size stored in a record made by snapshot_to_bytes'''
+    if len(record) != record_size(rows, columns):
+        raise SnapshotFileError(f"a {rows}x{columns} snapshot record must be {record_size(rows, columns)} bytes")
+
+    game_over, has_faller, row, col, state, *faller_cells = _RECORD_HEADER.unpack_from(record)
+    faller = None
+    if has_faller:
+        faller = FallerSnapshot(row, col, State(state), tuple(faller_cells[0:3]),
+                                tuple(State(s) for s in faller_cells[3:6]), tuple(faller_cells[6:9]))
+
+    return Snapshot(rows, columns, bytes(record[_RECORD_HEADER.size:]), faller, bool(game_over))
+
+
+def record_size(rows: int, columns: int) -> int:
+    '''Returns the size in bytes of the record of a snapshot of a game of the given size'''
+    return _RECORD_HEADER.size + 2 * (rows + 2) * columns
+
+
+def save_snapshots(path: str, snapshots: Iterable[Snapshot]) -> int:
+    '''
+    Writes snapshots of games of one board size to a file and returns how many
+    were written
+
+    The file starts with the board size and the colors that the color codes in
+    the records stand for, so it can be loaded by a process whose color codes differ
+    '''
+    snapshots = iter(snapshots)
+    first = next(snapshots, None)
+    if first is None:
+        raise ValueError("no snapshots to save")
+
+    rows, columns = first.rows, first.columns
+    colors = known_colors()[1:]
+    color_table = b"".join(_pack_color(color) for color in colors)
+    count = 0
+
+    with open(path, "wb") as file:
+        file.write(_FILE_HEADER.pack(_MAGIC, _VERSION, rows, columns, 0, len(colors)))
+        file.write(color_table)
+
+        file.write(snapshot_to_bytes(first))
+        count += 1
+        for snapshot in snapshots:
+            if (snapshot.rows, snapshot.columns) != (rows, columns):
+                raise ValueError("all snapshots in a file must have the same board size")
+            file.write(snapshot_to_bytes(snapshot))
+            count += 1
+
+        file.seek(0)
+        file.write(_FILE_HEADER.pack(_MAGIC, _VERSION, rows, columns, count, len(colors)))
+
+    return count
+
+
+def save_snapshot(path: str, snapshot: Snapshot) -> None:
+    '''Writes a single snapshot (e.g. a save file) to a file'''
+    save_snapshots(path, [snapshot])
+
+
+def load_snapshot(path: str) -> Snapshot:
+    '''Reads the first snapshot from a file written by save_snapshot or save_snapshots'''
+    with SnapshotFile(path) as snapshots:
+        if len(snapshots) == 0:
+            raise SnapshotFileError(f"{path} holds no snapshots")
+        return snapshots[0]
+
+
+class SnapshotFile():
+    '''
+    A read-only, memory-mapped file of snapshots: records are only read from
+    the mapping when they are indexed, so corpora larger than memory can be used
+    '''
+    def __init__(self, path: str) -> None:
+        self._file = open(path, "rb")
+        try:
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            self._read_header()
+        except (ValueError, struct.error, SnapshotFileError):
+            self.close()
+            raise
+
+    def __enter__(self) -> 'SnapshotFile':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __getitem__(self, index: int) -> Snapshot:
+        if index < 0:
+            index += self._count
+        if not 0 <= index < self._count:
+            raise IndexError("snapshot index out of range")
+
+        start = self._records_start + index * self._record_size
+        record = self._mmap[start:start + self._record_size]
+        if self._translation is not None:
+            header_size = _RECORD_HEADER.size
+            codes_size = (self._rows + 2) * self._columns
+            record = (record[:header_size] + record[header_size:header_size + codes_size].translate(self._translation)
+                      + record[header_size + codes_size:])
+            record = self._translate_faller_codes(record)
+
+        return snapshot_from_bytes(record, self._rows, self._columns)
+
+    def __iter__(self) -> Iterator[Snapshot]:
+        for index in range(self._count):
+            yield self[index]
+
+    def rows(self) -> int:
+        '''Returns the number of visible rows of the games in the file'''
+        return self._rows
+
+    def columns(self) -> int:
+        '''Returns the number of columns of the games in the file'''
+        return self._columns
+
+    def close(self) -> None:
+        '''Unmaps and closes the file'''
+        if getattr(self, "_mmap", None) is not None:
+            self._mmap.close()
+            self._mmap = None
+        self._file.close()
+
+    def _read_header(self) -> None:
+        '''Reads the board size, record count and color table of the file'''
+        if len(self._mmap) < _FILE_HEADER.size:
+            raise SnapshotFileError("snapshot file is too short")
+
+        magic, version, self._rows, self._columns, self._count, color_count = _FILE_HEADER.unpack_from(self._mmap)
+        if magic != _MAGIC or version != _VERSION:
+            raise SnapshotFileError("not a Columns snapshot file (or an unsupported version)")
+
+        offset = _FILE_HEADER.size
+        file_codes = [0]
+        for _ in range(color_count):
+            length = self._mmap[offset]
+            file_codes.append(color_code(self._mmap[offset + 1:offset + 1 + length].decode()))
+            offset += 1 + length
+
+        self._records_start = offset
+        self._record_size = record_size(self._rows, self._columns)
+        if len(self._mmap) < offset + self._count * self._record_size:
+            raise SnapshotFileError("snapshot file is truncated")
+
+        self._translation = None
+        if file_codes != list(range(len(file_codes))):
+            self._translation = bytes(file_codes + list(range(len(file_codes), 256)))
+
+    def _translate_faller_codes(self, record: bytes) -> bytes:
+        '''Maps the color codes of the Faller's Jewels in a record to this process's color codes'''
+        codes = record[_FALLER_CODES_OFFSET:_FALLER_CODES_OFFSET + 3].translate(self._translation)
+        return record[:_FALLER_CODES_OFFSET] + codes + record[_FALLER_CODES_OFFSET + 3:]
+
+
+def _pack_color(color: str) -> bytes:
+    '''Returns a color as a length-prefixed UTF-8 string'''
+    encoded = color.encode()
+    return bytes([len(encoded)]) + encoded
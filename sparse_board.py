@@ -0,0 +1,240 @@
+from game_mechanics import EMPTY, Jewel, GameState, State, ColumnSet, color_of, zobrist_key
+from field_views import FieldView
+import re
+
+
+_CHUNK_BITS = 4
+_DIRECTIONS = [(0, 1), (1, 0), (1, 1), (1, -1)]
+_OCCUPIED = re.compile(b"[^\x00]")
+
+
+class SparseGameState(GameState):
+    '''
+    A GameState that stores only the occupied cells of the field, in square
+    chunks of 2 ** _CHUNK_BITS cells per side: a chunk is a dict of the Jewels
+    in it, so its length is its occupancy, and a chunk is dropped as soon as
+    it is empty
+
+    Every whole-board operation walks the occupied chunks only, so memory and
+    time scale with the number of Jewels rather than the size of the board;
+    gravity only visits the columns that were written since they last settled.
+    field() hands out a view with the same indexing as the nested list
+    '''
+    def __init__(self, rows: int, columns: int, field: list[list[Jewel]] = None) -> None:
+        super().__init__(rows, columns, None)
+        self._chunks = {}
+        self._chunk_rows = {}
+        self._unsettled = set()
+
+        if field is not None:
+            for r, row in enumerate(field):
+                for c, jewel in enumerate(row):
+                    if jewel.code() != 0:
+                        self._put(r, c, jewel)
+
+        self._field = FieldView(self)
+        self._hash = self._full_hash()
+        self._matched_count = self._count_matched()
+        self._build_index()
+
+    def jewel_count(self) -> int:
+        '''Returns the number of Jewels in the field'''
+        return sum(len(chunk) for chunk in self._chunks.values())
+
+    def occupancy(self) -> dict[tuple[int, int], int]:
+        '''Returns the number of Jewels in every non-empty chunk, by (chunk row, chunk column)'''
+        return {key: len(chunk) for key, chunk in self._chunks.items()}
+
+    def normal_gravity(self) -> list[list[tuple[int, int]]]:
+        '''
+        Drops every Jewel to the bottom of the field, leaving no spaces under them;
+        returns, for every column, the (from_row, to_row) pairs of the Jewels that moved
+        '''
+        moves = [[] for _ in range(self._columns)]
+        for c in self._unsettled:
+            bottom = self._rows + 1
+            for r in sorted(self._column_rows(c), reverse=True):
+                if r != bottom:
+                    self._move_cell(r, bottom, c)
+                    moves[c].append((r, bottom))
+                bottom -= 1
+
+        self._unsettled = set()
+        return moves
+
+    def tick_gravity(self) -> list[list[tuple[int, int]]]:
+        '''
+        Drops every Jewel/Faller in the field once, given that there is a space under it;
+        returns, for every column, the (from_row, to_row) pairs of the Jewels that moved
+        '''
+        moves = [[] for _ in range(self._columns)]
+        for c in self._unsettled:
+            below = 0
+            for r in sorted(self._column_rows(c), reverse=True):
+                if self._rows + 1 - r > below:
+                    self._move_cell(r, r + 1, c)
+                    moves[c].append((r, r + 1))
+                below += 1
+
+        self._unsettled = {c for c, column_moves in enumerate(moves) if column_moves}
+
+        if self._faller != None and self._faller.state() == State.FALLING:
+            self._faller._row += 1
+
+        return moves
+
+    def remove_matches(self) -> None:
+        '''Removes matched Jewels from the field'''
+        matched = [cell for chunk in self._chunks.values() for cell, jewel in chunk.items()
+                   if jewel.state() == State.MATCHED]
+        for r, c in matched:
+            self._set_cell(r, c, EMPTY)
+        self._matched_count = 0
+
+    def match(self, incremental: bool = False) -> set[tuple[int, int]]:
+        '''
+        Marks every Jewel in a line of three or more matching Jewels as MATCHED
+        and returns the set of (row, column) coordinates that were matched
+
+        Runs are followed from occupied cells only: from the Jewels that start a
+        run, or with incremental, through every Jewel in a cell that changed
+        since the last match
+        '''
+        incremental = incremental and not self._all_dirty
+        if incremental:
+            cells = [cell for cell in self._dirty if self._cell(*cell).code() != 0]
+        else:
+            cells = [cell for chunk in self._chunks.values() for cell in chunk]
+
+        matched = set()
+        followed = set()
+        for r, c in cells:
+            code = self._cell(r, c).code()
+            for rowdelta, coldelta in _DIRECTIONS:
+                start_r, start_c = r, c
+                if incremental:
+                    while self._cell(start_r - rowdelta, start_c - coldelta).code() == code:
+                        start_r, start_c = start_r - rowdelta, start_c - coldelta
+                    if (start_r, start_c, rowdelta, coldelta) in followed:
+                        continue
+                    followed.add((start_r, start_c, rowdelta, coldelta))
+                elif self._cell(r - rowdelta, c - coldelta).code() == code:
+                    continue
+
+                length = 1
+                while self._cell(start_r + length * rowdelta, start_c + length * coldelta).code() == code:
+                    length += 1
+                if length >= 3:
+                    matched.update((start_r + i * rowdelta, start_c + i * coldelta) for i in range(length))
+
+        for r, c in matched:
+            jewel = self._cell(r, c)
+            if jewel.state() != State.MATCHED:
+                jewel.update_state(State.MATCHED)
+                self._matched_count += 1
+
+        self._dirty = set()
+        self._all_dirty = False
+        return matched
+
+    def _build_index(self) -> None:
+        '''Rebuilds the column heights, the free columns and the Jewels in the hidden rows from the occupied cells'''
+        self._heights = [0] * self._columns
+        top = set()
+        self._hidden = set()
+        for chunk in self._chunks.values():
+            for r, c in chunk:
+                self._heights[c] += 1
+                if r < 2:
+                    self._hidden.add((r, c))
+                elif r == 2:
+                    top.add(c)
+        self._free_columns = ColumnSet(self._columns, (c for c in range(self._columns) if c not in top))
+
+    def _column_rows(self, col: int) -> list[int]:
+        '''Returns the rows of the Jewels in a column, from the chunks of that column only'''
+        chunk_col = col >> _CHUNK_BITS
+        return [r for chunk_row in self._chunk_rows.get(chunk_col, ())
+                for r, c in self._chunks[(chunk_row, chunk_col)] if c == col]
+
+    def _count_matched(self) -> int:
+        '''Returns the number of matched Jewels in the field, counted from the occupied cells'''
+        return sum(1 for chunk in self._chunks.values() for jewel in chunk.values() if jewel.state() == State.MATCHED)
+
+    def _full_hash(self) -> int:
+        '''Returns the Zobrist hash of the colors in the field, computed from the occupied cells'''
+        board_hash = 0
+        for chunk in self._chunks.values():
+            for (r, c), jewel in chunk.items():
+                board_hash ^= self._key(r * self._columns + c, jewel.code())
+        return board_hash
+
+    def _cells(self) -> bytes:
+        '''Returns the color codes of every cell of the field followed by their states'''
+        size = (self._rows + 2) * self._columns
+        cells = bytearray(2 * size)
+        for chunk in self._chunks.values():
+            for (r, c), jewel in chunk.items():
+                cells[r * self._columns + c] = jewel.code()
+                cells[size + r * self._columns + c] = jewel.state()
+        return bytes(cells)
+
+    def _load_cells(self, cells: bytes) -> None:
+        '''Replaces the field with new Jewels built from the occupied cells of codes and states as returned by _cells'''
+        size = (self._rows + 2) * self._columns
+        self._chunks = {}
+        self._chunk_rows = {}
+        self._unsettled = set()
+        for occupied in _OCCUPIED.finditer(cells, 0, size):
+            r, c = divmod(occupied.start(), self._columns)
+            jewel = Jewel(color_of(cells[occupied.start()]))
+            jewel.update_state(State(cells[size + occupied.start()]))
+            self._put(r, c, jewel)
+
+    def _cell(self, row: int, col: int) -> Jewel:
+        '''Returns the Jewel in a cell of the field (EMPTY for an empty or out of range cell)'''
+        chunk = self._chunks.get((row >> _CHUNK_BITS, col >> _CHUNK_BITS))
+        if chunk is None:
+            return EMPTY
+        return chunk.get((row, col), EMPTY)
+
+    def _put(self, row: int, col: int, jewel: Jewel) -> None:
+        '''
+        Stores the Jewel in a cell of the field, dropping the cell (and its chunk,
+        once empty) for EMPTY; the column may now have a space under a Jewel
+        '''
+        key = (row >> _CHUNK_BITS, col >> _CHUNK_BITS)
+        chunk = self._chunks.get(key)
+        self._unsettled.add(col)
+
+        if jewel.code() != 0:
+            if chunk is None:
+                chunk = self._chunks[key] = {}
+                self._chunk_rows.setdefault(key[1], set()).add(key[0])
+            chunk[(row, col)] = jewel
+        elif chunk is not None:
+            chunk.pop((row, col), None)
+            if not chunk:
+                del self._chunks[key]
+                self._chunk_rows[key[1]].discard(key[0])
+
+    def _move_cell(self, row: int, to_row: int, col: int) -> None:
+        '''Moves the Jewel in a cell to an empty cell of the same column, marking both as changed'''
+        jewel = self._cell(row, col)
+        self._put(row, col, EMPTY)
+        self._put(to_row, col, jewel)
+        self._dirty.add((row, col))
+        self._dirty.add((to_row, col))
+
+        code = jewel.code()
+        self._hash ^= self._key(row * self._columns + col, code) ^ self._key(to_row * self._columns + col, code)
+        if row < 3:
+            self._index_cell(row, col, False)
+        if to_row < 3:
+            self._index_cell(to_row, col, True)
+
+    def _key(self, index: int, code: int) -> int:
+        '''Returns the Zobrist key of a color code in a cell, from the shared table if the board is small enough'''
+        if self._keys is not None:
+            return self._keys[code][index]
+        return zobrist_key(index, code)
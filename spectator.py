@@ -0,0 +1,529 @@
+from game_mechanics import Snapshot, State, known_colors
+from simulation import GameStats, Simulation, random_inputs
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Iterable
+import asyncio
+import socket
+import struct
+import threading
+import time
+
+
+_HOST = "127.0.0.1"
+_PORT = 7878
+_KEYFRAME = b"K"
+_DELTA = b"D"
+_LENGTH = struct.Struct("<I")
+_FRAME_HEADER = struct.Struct("<cIBBhHB")
+_KEYFRAME_HEADER = struct.Struct("<HHB")
+_DELTA_HEADER = struct.Struct("<I")
+_CELL = struct.Struct("<IBB")
+_KEYFRAME_INTERVAL = 60
+_BUFFER_LIMIT = 4 * 1024
+_BACKLOG = 1024
+_SEND_BUFFER = 8 * 1024
+_TICK_INTERVAL = 0.05
+_SYNC_TIMEOUT = 10.0
+
+
+def encode_keyframe(snapshot: Snapshot, tick: int) -> bytes:
+    '''
+    Returns a keyframe: the frame header (kind, tick, game over flag and Faller
+    position), the board size, the colors that the color codes stand for and
+    then the color code and state of every cell, enough for a spectator to sync
+    '''
+    colors = known_colors()
+    color_table = b"".join(bytes([len(color.encode())]) + color.encode() for color in colors[1:])
+    return _frame(_KEYFRAME, snapshot, tick,
+                  _KEYFRAME_HEADER.pack(snapshot.rows, snapshot.columns, len(colors) - 1) + color_table + snapshot.cells)
+
+
+def encode_delta(previous: bytes, snapshot: Snapshot, tick: int) -> bytes:
+    '''
+    Returns a delta: the frame header followed by the index, color code and
+    state of every cell that differs from the previous snapshot's cells
+    '''
+    cells = snapshot.cells
+    size = len(cells) // 2
+    changed = []
+    if cells != previous:
+        for i in range(size):
+            if cells[i] != previous[i] or cells[size + i] != previous[size + i]:
+                changed.append(_CELL.pack(i, cells[i], cells[size + i]))
+    return _frame(_DELTA, snapshot, tick, _DELTA_HEADER.pack(len(changed)) + b"".join(changed))
+
+
+def _frame(kind: bytes, snapshot: Snapshot, tick: int, body: bytes) -> bytes:
+    '''Returns a length-prefixed frame of the given kind and body'''
+    faller = snapshot.faller
+    if faller is None:
+        header = _FRAME_HEADER.pack(kind, tick, snapshot.game_over, False, 0, 0, 0)
+    else:
+        header = _FRAME_HEADER.pack(kind, tick, snapshot.game_over, True, faller.row, faller.col, faller.state)
+    return _LENGTH.pack(len(header) + len(body)) + header + body
+
+
+class _Spectator():
+    '''
+    A connected spectator: its transport, the most bytes that may wait in the
+    transport's buffer and whether it needs a keyframe before any more deltas
+    make sense to it
+    '''
+    def __init__(self, transport: asyncio.Transport, buffer_limit: int) -> None:
+        self.transport = transport
+        self.buffer_limit = buffer_limit
+        self.resync = True
+
+    def send(self, frame: bytes, keyframe: bool) -> bool:
+        '''
+        Writes a frame to the transport without waiting, unless the frames already
+        written have not drained below the buffer limit; after a dropped frame, the
+        spectator waits for a keyframe, since the next delta is relative to the
+        frame it missed. Returns False if the frame was dropped
+        '''
+        if self.transport.is_closing():
+            return False
+        if self.transport.get_write_buffer_size() > self.buffer_limit:
+            self.resync = True
+            return False
+
+        self.transport.write(frame)
+        if keyframe:
+            self.resync = False
+        return True
+
+
+class SpectatorServer():
+    '''
+    Broadcasts a game to any number of spectators over TCP: every published
+    tick is sent as a delta of the cells that changed, with a keyframe of the
+    whole board every keyframe_interval ticks and whenever a spectator joins
+
+    publish() never waits on a spectator: frames are written straight to each
+    spectator's transport, and a spectator whose unsent bytes are over the
+    buffer limit has frames dropped until it drains, then gets a keyframe
+    instead of the deltas it missed; a slow connection only ever costs the
+    game loop one buffer size check per tick
+    '''
+    def __init__(self, host: str = _HOST, port: int = _PORT, buffer_limit: int = _BUFFER_LIMIT,
+                 keyframe_interval: int = _KEYFRAME_INTERVAL) -> None:
+        self._host = host
+        self._port = port
+        self._buffer_limit = buffer_limit
+        self._keyframe_interval = keyframe_interval
+        self._server = None
+        self._spectators = set()
+        self._previous = None
+        self._last_keyframe = None
+        self._color_count = 0
+        self._stats = {"frames_sent": 0, "frames_dropped": 0, "keyframes": 0, "bytes_sent": 0,
+                       "publishes": 0, "publish_seconds": 0.0, "publish_max_seconds": 0.0}
+
+    async def start(self) -> None:
+        '''Starts accepting spectators'''
+        self._server = await asyncio.start_server(self._handle, self._host, self._port, backlog=_BACKLOG)
+
+    def address(self) -> tuple[str, int]:
+        '''Returns the host and port the server is listening on (the port chosen by the system for port 0)'''
+        return self._server.sockets[0].getsockname()[:2]
+
+    def spectator_count(self) -> int:
+        '''Returns the number of connected spectators'''
+        return len(self._spectators)
+
+    def publish(self, snapshot: Snapshot, tick: int, keyframe: bool = False) -> None:
+        '''
+        Sends a tick of the game to every spectator: a keyframe if one is due (or
+        asked for) or the spectator needs one, otherwise a delta from the
+        previously published tick
+
+        Must be called from the thread running the server's event loop
+        '''
+        start = time.perf_counter()
+        colors = len(known_colors())
+        keyframe = (keyframe or self._previous is None or colors != self._color_count
+                    or tick - self._last_keyframe >= self._keyframe_interval)
+
+        full = None
+        if keyframe:
+            full = encode_keyframe(snapshot, tick)
+            self._last_keyframe = tick
+            self._color_count = colors
+            self._stats["keyframes"] += 1
+        else:
+            delta = encode_delta(self._previous, snapshot, tick)
+        self._previous = snapshot.cells
+
+        for spectator in self._spectators:
+            if keyframe or spectator.resync:
+                if full is None:
+                    full = encode_keyframe(snapshot, tick)
+                frame = full
+            else:
+                frame = delta
+            if spectator.send(frame, frame is full):
+                self._stats["frames_sent"] += 1
+                self._stats["bytes_sent"] += len(frame)
+            else:
+                self._stats["frames_dropped"] += 1
+
+        elapsed = time.perf_counter() - start
+        self._stats["publishes"] += 1
+        self._stats["publish_seconds"] += elapsed
+        self._stats["publish_max_seconds"] = max(self._stats["publish_max_seconds"], elapsed)
+
+    async def flush(self, timeout: float = None) -> bool:
+        '''Waits until every frame was handed to the spectators' sockets; returns False if the timeout passed first'''
+        deadline = None if timeout is None else time.perf_counter() + timeout
+        while any(spectator.transport.get_write_buffer_size() > 0 for spectator in self._spectators
+                  if not spectator.transport.is_closing()):
+            if deadline is not None and time.perf_counter() >= deadline:
+                return False
+            await asyncio.sleep(0.01)
+        return True
+
+    def stats(self) -> dict:
+        '''Returns the number of spectators and frames, bytes and publish times so far'''
+        stats = dict(self._stats)
+        publishes = stats.pop("publishes")
+        stats["spectators"] = len(self._spectators)
+        stats["publish_mean_ms"] = stats.pop("publish_seconds") * 1000 / publishes if publishes else 0.0
+        stats["publish_max_ms"] = stats.pop("publish_max_seconds") * 1000
+        return stats
+
+    async def close(self) -> None:
+        '''Stops accepting spectators and disconnects every connected spectator'''
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+        for spectator in self._spectators:
+            spectator.transport.close()
+        while self._spectators:
+            await asyncio.sleep(0.01)
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        '''
+        Registers a spectator until it disconnects (or the server closes it);
+        spectators send nothing, so anything they do send is discarded
+        '''
+        writer.get_extra_info("socket").setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, _SEND_BUFFER)
+        spectator = _Spectator(writer.transport, self._buffer_limit)
+        self._spectators.add(spectator)
+
+        try:
+            while await reader.read(1024):
+                pass
+        except ConnectionError:
+            pass
+        finally:
+            self._spectators.discard(spectator)
+            writer.close()
+
+
+class SpectatorThread():
+    '''
+    Runs a SpectatorServer on an event loop in a background thread, so that a
+    game loop that is not itself asyncio (e.g. Columns) can publish to it
+    '''
+    def __init__(self, host: str = _HOST, port: int = _PORT, buffer_limit: int = _BUFFER_LIMIT,
+                 keyframe_interval: int = _KEYFRAME_INTERVAL) -> None:
+        self._server = SpectatorServer(host, port, buffer_limit, keyframe_interval)
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="spectators", daemon=True)
+        self._thread.start()
+        asyncio.run_coroutine_threadsafe(self._server.start(), self._loop).result()
+
+    def address(self) -> tuple[str, int]:
+        '''Returns the host and port the server is listening on'''
+        return self._server.address()
+
+    def publish(self, snapshot: Snapshot, tick: int) -> None:
+        '''Hands a tick of the game to the server's thread, without waiting for it to be sent'''
+        self._loop.call_soon_threadsafe(self._server.publish, snapshot, tick)
+
+    def stats(self) -> dict:
+        '''Returns the server's stats (see SpectatorServer.stats)'''
+        return asyncio.run_coroutine_threadsafe(self._stats(), self._loop).result()
+
+    def close(self) -> None:
+        '''Disconnects every spectator and stops the server's thread'''
+        asyncio.run_coroutine_threadsafe(self._server.close(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+
+    async def _stats(self) -> dict:
+        '''Reads the stats on the server's thread'''
+        return self._server.stats()
+
+
+async def stream_simulation(simulation: Simulation, server: SpectatorServer, tick_interval: float = _TICK_INTERVAL,
+                            max_ticks: int = None, inputs: Iterable[tuple[int, str]] = ()) -> GameStats:
+    '''
+    Plays a headless game in real time, one tick every tick_interval seconds,
+    publishing every tick to the server (starting with a keyframe, since the
+    board may belong to a new game); inputs are (tick, action) pairs as for
+    Simulation.run. Returns the statistics of the game
+    '''
+    pending = {}
+    for tick, action in inputs:
+        pending.setdefault(tick, []).append(action)
+
+    loop = asyncio.get_running_loop()
+    game_state = simulation.game_state()
+    server.publish(game_state.snapshot(), simulation.ticks(), keyframe=True)
+    next_tick = loop.time()
+
+    while max_ticks is None or simulation.ticks() < max_ticks:
+        running = simulation.step(pending.pop(simulation.ticks(), ()))
+        server.publish(game_state.snapshot(), simulation.ticks())
+        if not running:
+            break
+
+        next_tick += tick_interval
+        await asyncio.sleep(max(0.0, next_tick - loop.time()))
+
+    return simulation.stats()
+
+
+class BoardMirror():
+    '''
+    The board as a spectator sees it, rebuilt from the frames of a
+    SpectatorServer: deltas are ignored until the first keyframe arrives
+    '''
+    def __init__(self) -> None:
+        self.rows = 0
+        self.columns = 0
+        self.tick = None
+        self.game_over = False
+        self.faller = None
+        self.colors = [" "]
+        self._codes = bytearray()
+        self._states = bytearray()
+        self._synced = False
+
+    def synced(self) -> bool:
+        '''Returns True once a keyframe was applied'''
+        return self._synced
+
+    def cells(self) -> bytes:
+        '''Returns the color codes of every cell followed by their states, as in a Snapshot'''
+        return bytes(self._codes + self._states)
+
+    def apply(self, payload: bytes) -> bool:
+        '''Applies a frame (without its length prefix); returns False if it was a delta that could not be applied'''
+        kind, tick, game_over, has_faller, row, col, faller_state = _FRAME_HEADER.unpack_from(payload)
+        offset = _FRAME_HEADER.size
+
+        if kind == _KEYFRAME:
+            self.rows, self.columns, color_count = _KEYFRAME_HEADER.unpack_from(payload, offset)
+            offset += _KEYFRAME_HEADER.size
+            self.colors = [" "]
+            for _ in range(color_count):
+                length = payload[offset]
+                self.colors.append(payload[offset + 1:offset + 1 + length].decode())
+                offset += 1 + length
+            size = (self.rows + 2) * self.columns
+            self._codes = bytearray(payload[offset:offset + size])
+            self._states = bytearray(payload[offset + size:offset + 2 * size])
+            self._synced = True
+        elif kind == _DELTA:
+            if not self._synced:
+                return False
+            count, = _DELTA_HEADER.unpack_from(payload, offset)
+            for index, code, state in _CELL.iter_unpack(payload[offset + _DELTA_HEADER.size:
+                                                                offset + _DELTA_HEADER.size + count * _CELL.size]):
+                self._codes[index] = code
+                self._states[index] = state
+        else:
+            return False
+
+        self.tick = tick
+        self.game_over = bool(game_over)
+        self.faller = (row, col, State(faller_state)) if has_faller else None
+        return True
+
+    def render(self) -> str:
+        '''
+        Returns the visible field as text, one line per row: a Jewel is shown as
+        its color, in brackets while falling, between bars once landed and between
+        asterisks when matched
+        '''
+        lines = []
+        for r in range(2, self.rows + 2):
+            line = "|"
+            for c in range(self.columns):
+                index = r * self.columns + c
+                color = self.colors[self._codes[index]]
+                if self._codes[index] == 0:
+                    line += "   "
+                elif self._states[index] == State.FALLING:
+                    line += f"[{color}]"
+                elif self._states[index] == State.LANDED:
+                    line += f"|{color}|"
+                elif self._states[index] == State.MATCHED:
+                    line += f"*{color}*"
+                else:
+                    line += f" {color} "
+            lines.append(line + "|")
+        lines.append(" " + "-" * 3 * self.columns + " ")
+        if self.game_over:
+            lines.append("GAME OVER")
+        return "\n".join(lines)
+
+
+async def watch(host: str = _HOST, port: int = _PORT, on_frame: Callable[[BoardMirror], None] = None,
+                mirror: BoardMirror = None, reader_limit: int = 2 ** 16,
+                bandwidth: int = None) -> BoardMirror:
+    '''
+    Connects to a SpectatorServer as a spectator and applies its frames to a
+    mirror of the board until the server disconnects, calling on_frame after
+    every frame; a bandwidth (bytes per second) makes it a slow spectator,
+    for load tests. Returns the mirror
+    '''
+    mirror = mirror if mirror is not None else BoardMirror()
+    reader, writer = await _connect(host, port, reader_limit)
+    try:
+        while True:
+            length, = _LENGTH.unpack(await reader.readexactly(_LENGTH.size))
+            mirror.apply(await reader.readexactly(length))
+            if on_frame is not None:
+                on_frame(mirror)
+            if bandwidth is not None:
+                await asyncio.sleep((_LENGTH.size + length) / bandwidth)
+    except (asyncio.IncompleteReadError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+    return mirror
+
+
+async def _connect(host: str, port: int, reader_limit: int) -> tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+    '''Opens a connection whose receive buffers (the socket's and the reader's) are about reader_limit bytes'''
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, reader_limit)
+    sock.setblocking(False)
+    try:
+        await asyncio.get_running_loop().sock_connect(sock, (host, port))
+    except OSError:
+        sock.close()
+        raise
+    return await asyncio.open_connection(sock=sock, limit=reader_limit)
+
+
+def _spectate(host: str, port: int, clients: int, slow_clients: int, slow_bandwidth: int) -> list[tuple[int, bytes]]:
+    '''
+    Runs load test spectators (the first slow_clients of them slow, with small
+    receive buffers) in a worker process until the server disconnects them;
+    returns the tick and cells that each one ended with
+    '''
+    async def spectate() -> list[BoardMirror]:
+        return await asyncio.gather(*(watch(host, port, reader_limit=1024 if i < slow_clients else 2 ** 16,
+                                            bandwidth=slow_bandwidth if i < slow_clients else None)
+                                      for i in range(clients)))
+
+    return [(mirror.tick, mirror.cells()) for mirror in asyncio.run(spectate())]
+
+
+async def load_test(clients: int = 300, slow_clients: int = 30, ticks: int = 2000, tick_interval: float = 0.002,
+                    seed: int = 0, slow_bandwidth: int = 8 * 1024, workers: int = 4) -> dict:
+    '''
+    Streams seeded headless games (back to back, until the given number of
+    ticks was played) to hundreds of loopback spectators spread across worker
+    processes, some of them reading at only slow_bandwidth bytes per second; returns the server's stats, how late
+    the ticks ran and how many spectators ended in sync with the final board
+    '''
+    server = SpectatorServer("127.0.0.1", 0)
+    await server.start()
+    host, port = server.address()
+    loop = asyncio.get_running_loop()
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        shares = [clients // workers + (1 if i < clients % workers else 0) for i in range(workers)]
+        slow_shares = [slow_clients // workers + (1 if i < slow_clients % workers else 0) for i in range(workers)]
+        spectators = [loop.run_in_executor(executor, _spectate, host, port, share, slow_share, slow_bandwidth)
+                      for share, slow_share in zip(shares, slow_shares) if share > 0]
+
+        while server.spectator_count() < clients:
+            if any(future.done() for future in spectators):
+                await asyncio.gather(*spectators)
+                raise ConnectionError("a spectator process ended before every spectator connected")
+            await asyncio.sleep(0.01)
+
+        played = 0
+        start = time.perf_counter()
+        while played < ticks:
+            simulation = Simulation(seed)
+            played += (await stream_simulation(simulation, server, tick_interval, ticks - played,
+                                               random_inputs(seed, ticks - played))).ticks
+            seed += 1
+        elapsed = time.perf_counter() - start
+
+        final = simulation.game_state().snapshot()
+        await server.flush(_SYNC_TIMEOUT)
+        server.publish(final, simulation.ticks(), keyframe=True)
+        await server.flush(_SYNC_TIMEOUT)
+        result = server.stats()
+        await server.close()
+        mirrors = [mirror for share in await asyncio.gather(*spectators) for mirror in share]
+
+    result.update({"clients": clients, "slow_clients": slow_clients, "ticks": played, "seconds": elapsed,
+                   "ticks_late_ms": max(0.0, (elapsed - played * tick_interval) * 1000),
+                   "in_sync": sum(1 for tick, cells in mirrors if tick == simulation.ticks() and cells == final.cells)})
+    return result
+
+
+if __name__ == "__main__":
+    import argparse
+    import json
+
+    parser = argparse.ArgumentParser(description="Streams Columns games to spectators")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    serve_parser = commands.add_parser("serve", help="play seeded headless games back to back and stream them")
+    serve_parser.add_argument("--host", default=_HOST)
+    serve_parser.add_argument("--port", type=int, default=_PORT)
+    serve_parser.add_argument("--seed", type=int, default=0)
+    serve_parser.add_argument("--tick-interval", type=float, default=_TICK_INTERVAL)
+    serve_parser.add_argument("--max-ticks", type=int, default=10000)
+
+    watch_parser = commands.add_parser("watch", help="print the board of a streamed game as it changes")
+    watch_parser.add_argument("--host", default=_HOST)
+    watch_parser.add_argument("--port", type=int, default=_PORT)
+
+    load_parser = commands.add_parser("load-test", help="stream a game to many loopback spectators")
+    load_parser.add_argument("--clients", type=int, default=300)
+    load_parser.add_argument("--slow-clients", type=int, default=30)
+    load_parser.add_argument("--ticks", type=int, default=2000)
+    load_parser.add_argument("--tick-interval", type=float, default=0.002)
+    load_parser.add_argument("--seed", type=int, default=0)
+    load_parser.add_argument("--slow-bandwidth", type=int, default=8 * 1024, help="bytes per second a slow spectator reads")
+    load_parser.add_argument("--workers", type=int, default=4, help="processes to run the spectators in")
+
+    args = parser.parse_args()
+
+    async def serve() -> None:
+        server = SpectatorServer(args.host, args.port)
+        await server.start()
+        print(f"streaming on {server.address()[0]}:{server.address()[1]}")
+        seed = args.seed
+        while True:
+            await stream_simulation(Simulation(seed), server, args.tick_interval, args.max_ticks,
+                                    random_inputs(seed, args.max_ticks))
+            seed += 1
+
+    def show(mirror: BoardMirror) -> None:
+        print(f"\x1b[H\x1b[Jtick {mirror.tick}\n{mirror.render()}", flush=True)
+
+    try:
+        if args.command == "serve":
+            asyncio.run(serve())
+        elif args.command == "watch":
+            asyncio.run(watch(args.host, args.port, on_frame=show))
+        else:
+            print(json.dumps(asyncio.run(load_test(args.clients, args.slow_clients, args.ticks,
+                                                   args.tick_interval, args.seed, args.slow_bandwidth, args.workers)), indent=2))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,249 @@
+from game_mechanics import Jewel, State
+from simulation import GameStats, Simulation, COLUMN_COUNT, JEWEL_COLORS, ROW_COUNT
+from autoplayer import AutoPlayer
+from typing import TextIO
+import os
+import select
+import sys
+import time
+
+try:
+    import termios
+    import tty
+except ImportError:
+    termios = None
+
+
+_JEWEL_RGB = {"R": (255, 0, 0), "O": (255, 165, 0), "Y": (255, 255, 0), "G": (0, 255, 0),
+              "B": (0, 255, 255), "P": (181, 126, 220), "Z": (255, 192, 203)}
+_MARKERS = {State.FALLING: "[]", State.LANDED: "||", State.MATCHED: "**"}
+_CELL_WIDTH = 3
+_RESET = "\x1b[0m"
+_CLEAR = "\x1b[2J"
+_HIDE_CURSOR = "\x1b[?25l"
+_SHOW_CURSOR = "\x1b[?25h"
+_KEYS = {"\x1b[D": "left", "\x1b[C": "right", "\x1b[B": "down", " ": "rotate"}
+_QUIT_KEYS = {"q", "\x03"}
+_TICK_LENGTH = 1.0
+
+
+class TerminalRenderer():
+    '''
+    Draws the visible field in a terminal with ANSI escape codes, writing only
+    the cells whose contents changed since the previous frame (the cursor is
+    moved straight to each one), so a frame costs a few bytes rather than the
+    whole screen
+
+    A Jewel is drawn in its color (24-bit, as in the pygame display): in
+    brackets while falling, between bars once landed and between asterisks
+    when matched
+    '''
+    def __init__(self, stream: TextIO = None, origin: tuple[int, int] = (1, 1)) -> None:
+        self._stream = stream if stream is not None else sys.stdout
+        self._origin = origin
+        self._cells = {}
+        self._drawn = {}
+        self._size = None
+
+    def invalidate(self) -> None:
+        '''Forces the next frame to clear the screen and redraw the whole board'''
+        self._drawn = {}
+        self._size = None
+
+    def draw(self, field: list[list[Jewel]]) -> int:
+        '''Draws the cells of the visible field that changed since the last frame and returns how many there were'''
+        rows, columns = len(field) - 2, len(field[0]) if len(field) > 0 else 0
+        output = []
+        if self._size != (rows, columns):
+            self._size = (rows, columns)
+            self._drawn = {}
+            output.append(_RESET + _CLEAR + self._outline(rows, columns))
+
+        changed = 0
+        for r, row in enumerate(field[2:]):
+            for c, jewel in enumerate(row):
+                key = (" ", State.FROZEN) if jewel.code() == 0 else (jewel.color(), jewel.state())
+                if self._drawn.get((r, c)) != key:
+                    output.append(self._move(r, c) + self._cell(key))
+                    self._drawn[(r, c)] = key
+                    changed += 1
+
+        if output:
+            output.append(self._move(rows + 1, -1))
+            self._stream.write("".join(output))
+            self._stream.flush()
+        return changed
+
+    def message(self, text: str) -> None:
+        '''Writes a line of text under the board'''
+        rows = self._size[0] if self._size is not None else 0
+        self._stream.write(self._move(rows + 1, -1) + text + "\r\n")
+        self._stream.flush()
+
+    def _outline(self, rows: int, columns: int) -> str:
+        '''Returns the sides and bottom of the board'''
+        width = _CELL_WIDTH * columns
+        sides = "".join(self._move(r, -1) + "|" + self._move(r, columns) + "|" for r in range(rows))
+        return sides + self._move(rows, -1) + " " + "-" * width + " "
+
+    def _move(self, row: int, col: int) -> str:
+        '''Returns the escape code that moves the cursor to a cell of the board (column -1 is the left side)'''
+        if col < 0:
+            return f"\x1b[{self._origin[0] + row};{self._origin[1]}H"
+        return f"\x1b[{self._origin[0] + row};{self._origin[1] + 1 + col * _CELL_WIDTH}H"
+
+    def _cell(self, key: tuple[str, State]) -> str:
+        '''Returns the cached text of a cell with the given contents, rendering it if needed'''
+        text = self._cells.get(key)
+        if text is None:
+            text = self._render_cell(key)
+            self._cells[key] = text
+        return text
+
+    def _render_cell(self, key: tuple[str, State]) -> str:
+        '''Renders a cell: blank if it is empty, otherwise the Jewel's color with its state's markers'''
+        color, state = key
+        if color == " ":
+            return " " * _CELL_WIDTH
+
+        red, green, blue = _JEWEL_RGB.get(color, (255, 255, 255))
+        left, right = _MARKERS.get(state, "  ")
+        return f"\x1b[1;30;48;2;{red};{green};{blue}m{left}{color}{right}{_RESET}"
+
+
+class RawKeyboard():
+    '''
+    Reads key presses from a terminal in raw mode (no echo, no line buffering,
+    no signals from Ctrl-C) without blocking; used as a context manager, which
+    restores the terminal's mode on exit
+    '''
+    def __init__(self, stream: TextIO = None) -> None:
+        self._fd = (stream if stream is not None else sys.stdin).fileno()
+        self._saved = None
+        self._pending = ""
+
+    def __enter__(self) -> 'RawKeyboard':
+        if termios is None:
+            raise OSError("reading the keyboard in raw mode needs a POSIX terminal")
+        self._saved = termios.tcgetattr(self._fd)
+        tty.setraw(self._fd)
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        termios.tcsetattr(self._fd, termios.TCSADRAIN, self._saved)
+
+    def read(self, timeout: float) -> list[str]:
+        '''
+        Returns the keys pressed, as soon as there are any, or an empty list once
+        the timeout (in seconds) passes; an arrow key is one three-character key
+        '''
+        ready, _, _ = select.select([self._fd], [], [], max(0.0, timeout))
+        if not ready:
+            return []
+
+        data = self._pending + os.read(self._fd, 64).decode(errors="ignore")
+        self._pending = ""
+        keys = []
+        i = 0
+        while i < len(data):
+            if data[i] == "\x1b" and data[i + 1:i + 2] in ("", "["):
+                if len(data) - i < 3:
+                    self._pending = data[i:]
+                    break
+                keys.append(data[i:i + 3])
+                i += 3
+            else:
+                keys.append(data[i])
+                i += 1
+        return keys
+
+
+class TerminalGame():
+    '''
+    Plays Columns in a terminal, without pygame: the game mechanics advance one
+    tick every tick_length seconds (the down key makes the next tick due at
+    once), the keyboard is read in raw mode while waiting for the next tick and
+    every frame only redraws the cells that changed; in demo mode the autoplayer
+    plays and only the quit keys (q, Ctrl-C) are read
+    '''
+    def __init__(self, seed: int = None, rows: int = ROW_COUNT, columns: int = COLUMN_COUNT,
+                 tick_length: float = _TICK_LENGTH, demo: bool = False,
+                 output: TextIO = None, keyboard: TextIO = None) -> None:
+        self._simulation = Simulation(seed, rows, columns, JEWEL_COLORS)
+        self._game_state = self._simulation.game_state()
+        self._tick_length = tick_length
+        self._autoplayer = AutoPlayer(colors=JEWEL_COLORS) if demo else None
+        self._renderer = TerminalRenderer(output)
+        self._output = output if output is not None else sys.stdout
+        self._keyboard = keyboard
+        self._running = True
+
+    def run(self) -> GameStats:
+        '''Runs the game until it is over or a quit key is pressed; returns the statistics of the game'''
+        self._output.write(_HIDE_CURSOR)
+        try:
+            with RawKeyboard(self._keyboard) as keyboard:
+                next_tick = time.perf_counter() + self._tick_length
+                while self._running and not self._simulation.check_game_over():
+                    self._create_faller()
+                    self._renderer.draw(self._game_state.field())
+
+                    for key in keyboard.read(next_tick - time.perf_counter()):
+                        next_tick = self._handle_key(key, next_tick)
+
+                    now = time.perf_counter()
+                    if self._running and now >= next_tick:
+                        self._simulation.tick()
+                        next_tick = max(next_tick + self._tick_length, now)
+
+                self._renderer.draw(self._game_state.field())
+                if self._game_state.game_over():
+                    self._renderer.message("GAME OVER")
+        finally:
+            self._output.write(_SHOW_CURSOR)
+            self._output.flush()
+            if self._autoplayer is not None:
+                self._autoplayer.close()
+
+        return self._simulation.stats()
+
+    def _handle_key(self, key: str, next_tick: float) -> float:
+        '''
+        Handles a key press: the arrow keys and the space bar are player actions
+        (ignored in demo mode), q and Ctrl-C quit; returns when the next tick is due
+        '''
+        if key in _QUIT_KEYS:
+            self._running = False
+            return next_tick
+
+        action = _KEYS.get(key)
+        if action is None or self._autoplayer is not None:
+            return next_tick
+        if self._simulation.apply_action(action) and action == "down":
+            return time.perf_counter()
+        return next_tick
+
+    def _create_faller(self) -> None:
+        '''Creates a Faller if needed; in demo mode, the autoplayer's moves for a new Faller are applied right away'''
+        faller = self._game_state.faller()
+        self._simulation.create_faller()
+
+        new_faller = self._game_state.faller()
+        if self._autoplayer is not None and new_faller is not None and new_faller is not faller:
+            for action in self._autoplayer.choose(self._game_state).actions:
+                self._simulation.apply_action(action)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Columns in a terminal (arrow keys move, space rotates, q quits)")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--rows", type=int, default=ROW_COUNT)
+    parser.add_argument("--columns", type=int, default=COLUMN_COUNT)
+    parser.add_argument("--tick", type=float, default=_TICK_LENGTH, help="seconds per game tick")
+    parser.add_argument("--demo", action="store_true", help="let the autoplayer play")
+    args = parser.parse_args()
+
+    stats = TerminalGame(args.seed, args.rows, args.columns, args.tick, args.demo).run()
+    print(f"ticks: {stats.ticks}  jewels cleared: {stats.jewels_cleared}  longest chain: {stats.max_chain}")
@@ -0,0 +1,85 @@
+from game_mechanics import Jewel, GameState, State
+from array_board import ArrayGameState
+from sparse_board import SparseGameState
+from simulation import Simulation, random_inputs
+import random
+import pytest
+
+
+_BACKENDS = [GameState, ArrayGameState, SparseGameState]
+_COLORS = ["R", "G", "B"]
+_DIRECTIONS = [(0, 1), (1, 1), (1, 0), (1, -1), (0, -1), (-1, -1), (-1, 0), (-1, 1)]
+
+
+def _random_field(rng: random.Random, rows: int, columns: int) -> list[list[Jewel]]:
+    return [[Jewel(rng.choice(_COLORS)) if rng.random() < 0.7 else Jewel(" ") for _ in range(columns)]
+            for _ in range(rows + 2)]
+
+
+def _eight_direction_matches(field: list[list[Jewel]]) -> set[tuple[int, int]]:
+    '''The original matcher: every Jewel followed by two of its color in any of the eight directions starts a match'''
+    matched = set()
+    for r, row in enumerate(field):
+        for c, jewel in enumerate(row):
+            if jewel.color() == " ":
+                continue
+            for rowdelta, coldelta in _DIRECTIONS:
+                cells = [(r + i * rowdelta, c + i * coldelta) for i in range(3)]
+                if all(0 <= cr < len(field) and 0 <= cc < len(row) and field[cr][cc].color() == jewel.color()
+                       for cr, cc in cells):
+                    matched.update(cells)
+    return matched
+
+
+@pytest.mark.parametrize("backend", _BACKENDS)
+def test_match_agrees_with_eight_direction_scan(backend: type) -> None:
+    rng = random.Random(2)
+    for _ in range(3000):
+        rows, columns = rng.randint(1, 8), rng.randint(1, 8)
+        field = _random_field(rng, rows, columns)
+        expected = _eight_direction_matches(field)
+
+        game_state = backend(rows, columns, field)
+        assert game_state.match() == expected
+        assert game_state.check_match() == bool(expected)
+        states = game_state.snapshot().cells[(rows + 2) * columns:]
+        assert {divmod(i, columns) for i, state in enumerate(states) if state == State.MATCHED} == expected
+
+
+def _empty_field(rows: int, columns: int) -> list[list[Jewel]]:
+    return [[Jewel(" ") for _ in range(columns)] for _ in range(rows + 2)]
+
+
+def _assert_consistent(game_state: GameState, expected: GameState) -> None:
+    assert game_state.snapshot() == expected.snapshot()
+    assert game_state.board_hash() == game_state._full_hash() == expected.board_hash()
+    assert game_state.check_match() == expected.check_match()
+    for c in range(expected.columns()):
+        assert game_state.column_height(c) == expected.column_height(c)
+    assert game_state.free_column_count() == expected.free_column_count()
+    for i in range(expected.free_column_count()):
+        assert game_state.free_column(i) == expected.free_column(i)
+
+
+@pytest.mark.parametrize("seed", range(300))
+def test_backends_play_the_same_games(seed: int) -> None:
+    rows, columns = random.Random(seed).choice([(13, 6), (8, 4), (20, 10)])
+    max_ticks = 400
+    simulations = [Simulation(seed, rows, columns, game_state=backend(rows, columns, _empty_field(rows, columns)))
+                   for backend in _BACKENDS]
+    pending = {}
+    for tick, action in random_inputs(seed, max_ticks):
+        pending.setdefault(tick, []).append(action)
+
+    for tick in range(max_ticks):
+        running = [simulation.step(pending.get(tick, ())) for simulation in simulations]
+        assert running == [running[0]] * len(simulations)
+
+        expected = simulations[0].game_state()
+        assert expected.board_hash() == expected._full_hash()
+        for simulation in simulations[1:]:
+            _assert_consistent(simulation.game_state(), expected)
+        if not running[0]:
+            break
+
+    assert len({simulation.stats() for simulation in simulations}) == 1
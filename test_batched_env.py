@@ -0,0 +1,76 @@
+from game_mechanics import Jewel, Faller, GameState, State, color_of
+from batched_env import BatchedEnv
+from simulation import Simulation
+import numpy as np
+import pytest
+
+
+_ROWS = 13
+_COLUMNS = 6
+
+
+def _mirror_faller(simulation: Simulation, env: BatchedEnv, observations: np.ndarray, board: int) -> None:
+    '''Places the Faller the env just created on a board in the mirrored game, with the same column and colors'''
+    game_state = simulation.game_state()
+    if game_state.faller() is None and not game_state.check_match() and env._faller_state[board] != State.FROZEN:
+        col = int(env._faller_col[board])
+        colors = [color_of(int(observations[board, 0, r, col])) for r in range(3)]
+        game_state.place_faller(Faller(game_state, col + 1, *(Jewel(color) for color in colors)))
+
+
+def _hard_drop(game_state: GameState) -> None:
+    '''Drops a falling Faller until it lands, as the env's drop action does, without ticking the game'''
+    faller = game_state.faller()
+    while faller.state() == State.FALLING:
+        game_state.tick_gravity()
+        faller.check_if_landed()
+
+
+def _mirror_game(env: BatchedEnv, observations: np.ndarray, board: int) -> Simulation:
+    simulation = Simulation(0, _ROWS, _COLUMNS)
+    _mirror_faller(simulation, env, observations, board)
+    return simulation
+
+
+@pytest.mark.parametrize("actions", [["none", "left", "right", "rotate"], ["none", "left", "right", "rotate", "drop"]])
+def test_env_plays_like_simulation(actions: list[str]) -> None:
+    count = 64
+    env = BatchedEnv(count, _ROWS, _COLUMNS, seed=7)
+    codes = np.array([env.actions().index(action) for action in actions])
+    observations = env.reset()
+    simulations = [_mirror_game(env, observations, board) for board in range(count)]
+    rng = np.random.default_rng(11)
+    finished = 0
+
+    for _ in range(1500):
+        step_actions = codes[rng.integers(0, len(codes), count)]
+        observations, rewards, dones = env.step(step_actions)
+
+        for board, simulation in enumerate(simulations):
+            game_state = simulation.game_state()
+            action = env.actions()[step_actions[board]]
+            if game_state.faller() is not None:
+                if action == "drop":
+                    if game_state.faller().state() == State.FALLING:
+                        _hard_drop(game_state)
+                elif action != "none":
+                    simulation.apply_action(action)
+
+            cleared = simulation.stats().jewels_cleared
+            simulation.tick()
+            assert simulation.stats().jewels_cleared - cleared == rewards[board]
+
+            over = simulation.check_game_over()
+            if not over and game_state.faller() is None and not game_state.check_match():
+                over = game_state.free_column_count() == 0
+            assert over == dones[board]
+
+            if dones[board]:
+                simulations[board] = _mirror_game(env, observations, board)
+                finished += 1
+            else:
+                _mirror_faller(simulation, env, observations, board)
+            assert simulations[board].game_state().snapshot().cells == observations[board].tobytes()
+
+    assert finished > 0
+    assert len(env.finished_episodes()) == finished
@@ -0,0 +1,29 @@
+import os
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+
+from project5 import Columns
+from replay import board_checksum, play_file
+import random
+import pytest
+
+
+_ACTIONS = ["left", "right", "rotate", "down"]
+
+
+@pytest.mark.parametrize("seed", range(30))
+def test_recording_stopped_mid_game_replays(seed: int, tmp_path) -> None:
+    random.seed(seed)
+    path = str(tmp_path / "game.clrp")
+    game = Columns(record_path=path)
+    rng = random.Random(seed)
+
+    for _ in range(rng.randrange(20, 300)):
+        if rng.random() < 0.5:
+            game._apply_action(rng.choice(_ACTIONS))
+        if not game._advance(1):
+            break
+    game._recorder.save(path, game._simulation.ticks(), game._game_state)
+
+    simulation = play_file(path)
+    assert simulation.ticks() == game._simulation.ticks()
+    assert board_checksum(simulation.game_state()) == board_checksum(game._game_state)